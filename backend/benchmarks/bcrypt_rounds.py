@@ -0,0 +1,58 @@
+"""
+Measures bcrypt latency and throughput per work factor, to pick LESSNOTES_BCRYPT_ROUNDS
+and the number of password workers (PASSWORD_WORKERS in users/passwords.py).
+
+Usage (from backend/):
+    python benchmarks/bcrypt_rounds.py --rounds 10 11 12 13 --workers 1 2 4 8 --hashes 32
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+def run(rounds: int, workers: int, hashes: int) -> dict:
+    password = b'correct horse battery staple'
+    latencies = []
+
+    def task():
+        started_at = time.perf_counter()
+        bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+        latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(task) for _ in range(hashes)]:
+            future.result()
+    elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        'rounds': rounds,
+        'workers': workers,
+        'hashesPerSecond': hashes / elapsed,
+        'p50Ms': latencies[len(latencies) // 2] * 1000,
+        'p95Ms': latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 11, 12, 13])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--hashes', type=int, default=32)
+    args = parser.parse_args()
+
+    for rounds in args.rounds:
+        for workers in args.workers:
+            result = run(rounds, workers, args.hashes)
+            print(
+                f"rounds {result['rounds']:>2} workers {result['workers']:>2}: "
+                f"{result['hashesPerSecond']:8.1f} hashes/s "
+                f"p50 {result['p50Ms']:8.1f} ms p95 {result['p95Ms']:8.1f} ms"
+            )
+
+
+if __name__ == '__main__':
+    main()
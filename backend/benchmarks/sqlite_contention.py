@@ -0,0 +1,97 @@
+"""
+Measures write throughput of the SQLite storage profiles under concurrent writers and readers.
+
+Usage (from backend/):
+    python benchmarks/sqlite_contention.py --writers 8 --readers 4 --seconds 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'modules'))
+
+from utils.storage import STORAGE_PROFILES, apply_pragmas, engine_options
+
+
+def run_profile(profile: str, writers: int, readers: int, seconds: float) -> dict:
+    directory = tempfile.mkdtemp(prefix='lessnotes-bench-')
+    engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}", **engine_options(profile))
+    apply_pragmas(engine, profile)
+    with engine.begin() as connection:
+        connection.execute(text(
+            'CREATE TABLE message (id INTEGER PRIMARY KEY AUTOINCREMENT, text VARCHAR(10000) NOT NULL, '
+            '"conversationId" INTEGER NOT NULL, "isHuman" BOOLEAN NOT NULL)'
+        ))
+
+    counts = {'writes': 0, 'reads': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def write(worker):
+        while time.perf_counter() < deadline:
+            try:
+                # one transaction per row, like create_message and create_file
+                with engine.begin() as connection:
+                    connection.execute(
+                        text('INSERT INTO message (text, "conversationId", "isHuman") VALUES (:text, :conversation, 1)'),
+                        {'text': 'x' * 200, 'conversation': worker},
+                    )
+                with lock:
+                    counts['writes'] += 1
+            except Exception:
+                with lock:
+                    counts['errors'] += 1
+
+    def read(worker):
+        while time.perf_counter() < deadline:
+            try:
+                with engine.connect() as connection:
+                    connection.execute(
+                        text('SELECT * FROM message WHERE "conversationId" = :conversation ORDER BY id DESC LIMIT 50'),
+                        {'conversation': worker},
+                    ).fetchall()
+                with lock:
+                    counts['reads'] += 1
+            except Exception:
+                with lock:
+                    counts['errors'] += 1
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=read, args=(i,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    return {
+        'profile': profile,
+        'writesPerSecond': counts['writes'] / seconds,
+        'readsPerSecond': counts['reads'] / seconds,
+        'errors': counts['errors'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--profiles', nargs='+', default=list(STORAGE_PROFILES))
+    args = parser.parse_args()
+
+    for profile in args.profiles:
+        result = run_profile(profile, args.writers, args.readers, args.seconds)
+        print(
+            f"{result['profile']:>12}: {result['writesPerSecond']:10.1f} writes/s "
+            f"{result['readsPerSecond']:10.1f} reads/s {result['errors']:6d} errors"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,16 @@
-from flask import jsonify
+from flask import jsonify, request
 from __main__ import app, db
-from users.user import get_user_by_id
+from users.user import authorize_user
 from datetime import datetime
+from utils.pagination import keyset_page, parse_page_args
 
 class Conversation(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    userId = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    userId = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     time = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    # rolling summary of the messages up to and including summarizedUntil
+    summary = db.Column(db.Text, nullable=True)
+    summarizedUntil = db.Column(db.Integer, nullable=True)
 
     def to_dict(self):
         return {
@@ -29,7 +33,7 @@ def create_conversation(user_id):
         if not user_id:
             return jsonify({'error': 'UserId is required'})
         
-        user = get_user_by_id(user_id)
+        user = authorize_user(user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
 
@@ -43,21 +47,36 @@ def create_conversation(user_id):
             'message': 'Conversation created successfully',
             'conversation': new_conversation.to_dict()
             }), 201
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'An error occurred while creating a conversation', 'details': str(e)}), 500
     
 @app.route('/users/<int:user_id>/conversations', methods=['GET'])
 def get_conversations_by_user_id(user_id):
+    """
+    Returns the conversations of a user, newest first.
+    Older conversations are fetched by passing the returned nextCursor as `before`.
+    """
     try:
-        user = get_user_by_id(user_id)
+        try:
+            limit, before = parse_page_args(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        user = authorize_user(user_id)
         if not user:
-            return jsonify({'error': 'User does with id '+ user_id +' not exist'}), 404
-        conversations = Conversation.query.filter_by(userId=user_id).all()
+            return jsonify({'error': f'User with id {user_id} does not exist'}), 404
+        conversations, next_cursor = keyset_page(
+            Conversation.query.filter_by(userId=user_id), Conversation.id, limit, before
+        )
         if not conversations:
             return jsonify({'error': 'No conversations found'}), 404
         return jsonify({
-            'conversations': [conversation.to_dict() for conversation in conversations]
+            'conversations': [conversation.to_dict() for conversation in conversations],
+            'nextCursor': next_cursor
         }), 200
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
     except Exception as e:
         return jsonify({'error': 'An error occurred while retrieving conversations', 'details': str(e)}), 500
\ No newline at end of file
@@ -1,11 +1,13 @@
 from flask import jsonify, request
 from __main__ import app, db
 from conversations.conversation import get_conversation_by_id
+from users.user import authorize_user
+from utils.pagination import keyset_page, parse_page_args
 
 class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     text = db.Column(db.String(10000), nullable=False)
-    conversationId = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    conversationId = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False, index=True)
     isHuman = db.Column(db.Boolean, nullable=False)
 
     def to_dict(self):
@@ -18,18 +20,45 @@ class Message(db.Model):
     
 def get_messages_by_conversation_id(conversation_id):
     try:
-        messages = Message.query.filter_by(conversationId=conversation_id).all()
-        return sorted(messages, key=lambda message: message.id)
+        return Message.query.filter_by(conversationId=conversation_id).order_by(Message.id).all()
     except Exception as e:
         return None
+
+def get_messages_page(conversation_id, limit, before=None):
+    """
+    Returns a page of the messages of a conversation, going back from the newest one.
+
+    Returns:
+        tuple[list[Message], int]: The messages, oldest first, and the cursor of the next (older) page
+    """
+    messages, next_cursor = keyset_page(
+        Message.query.filter_by(conversationId=conversation_id), Message.id, limit, before
+    )
+    messages.reverse()
+    return messages, next_cursor
     
 @app.route('/conversation/<int:conversation_id>/messages', methods=['GET'])
 def get_messages_by_conversation_id_frontend(conversation_id):
+    """
+    Returns the latest messages of a conversation, oldest first.
+    Older messages are fetched by passing the returned nextCursor as `before`.
+    """
     try:
-        messages = get_messages_by_conversation_id(conversation_id)
+        try:
+            limit, before = parse_page_args(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        conversation = get_conversation_by_id(conversation_id)
+        if not conversation:
+            return jsonify({'error': 'Conversation not found'}), 404
+        authorize_user(conversation.userId)
+        messages, next_cursor = get_messages_page(conversation_id, limit, before)
         return jsonify({
-            'messages': [message.to_dict() for message in messages]
+            'messages': [message.to_dict() for message in messages],
+            'nextCursor': next_cursor
             }), 200
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
     except Exception as e:
         return jsonify({'error': 'An error occurred while getting messages', 'details': str(e)}), 500
     
@@ -45,6 +74,7 @@ def create_message(conversation_id):
         conversation = get_conversation_by_id(conversation_id)
         if not conversation:
             return jsonify({'error': 'Conversation not found'}), 404
+        authorize_user(conversation.userId)
 
         new_message = Message(
             text=text,
@@ -57,6 +87,8 @@ def create_message(conversation_id):
             'message': 'Message created successfully',
             'createdMessage': new_message.to_dict()
             }), 201
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'An error occurred while creating a message', 'details': str(e)}), 500
\ No newline at end of file
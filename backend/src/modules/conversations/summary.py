@@ -0,0 +1,118 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_community.chat_models import ChatOllama
+
+from __main__ import app, db
+from conversations.conversation import Conversation
+from conversations.message import Message
+
+# messages kept verbatim in the history, older ones are folded into the summary
+RECENT_MESSAGES = 6
+# upper bound on the unsummarized messages read per turn while the summary catches up
+MAX_UNSUMMARIZED_MESSAGES = RECENT_MESSAGES + 20
+# messages folded into the summary per LLM call
+SUMMARY_BATCH_SIZE = 20
+
+SUMMARY_PROMPT = """
+You maintain a running summary of a conversation between a student and an assistant.
+Update the summary with the new messages below. Keep the topics, questions and facts
+that later questions may refer to. Answer with the updated summary only.
+
+Current summary: {summary}
+
+New messages:
+{messages}
+
+Updated summary:
+"""
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='summary')
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def format_messages(messages) -> str:
+    return "\n".join(f"{'Human' if message.isHuman else 'AI'}: {message.text}" for message in messages)
+
+
+def get_conversation_history(conversation_id):
+    """
+    Returns the rolling summary of a conversation and the messages not folded into it yet.
+    The number of messages read is bounded whatever the length of the conversation.
+
+    Returns:
+        tuple[str, list[Message]]: The summary (None if there is none yet) and the recent messages, oldest first
+    """
+    conversation = Conversation.query.get(conversation_id)
+    summarized_until = (conversation.summarizedUntil if conversation else None) or 0
+    messages = (
+        Message.query
+        .filter(Message.conversationId == conversation_id, Message.id > summarized_until)
+        .order_by(Message.id.desc())
+        .limit(MAX_UNSUMMARIZED_MESSAGES)
+        .all()
+    )
+    messages.reverse()
+    if len(messages) > RECENT_MESSAGES:
+        schedule_summary_update(conversation_id)
+    return (conversation.summary if conversation else None), messages
+
+
+def schedule_summary_update(conversation_id) -> None:
+    """
+    Folds the messages older than the recent window into the summary on a background thread.
+    Requests for a conversation that is already scheduled are coalesced.
+    """
+    with _pending_lock:
+        if conversation_id in _pending:
+            return
+        _pending.add(conversation_id)
+    _executor.submit(_update_summary, conversation_id)
+
+
+def _update_summary(conversation_id) -> None:
+    try:
+        with app.app_context():
+            conversation = Conversation.query.get(conversation_id)
+            if not conversation:
+                return
+            recent = (
+                Message.query
+                .filter_by(conversationId=conversation_id)
+                .order_by(Message.id.desc())
+                .limit(RECENT_MESSAGES)
+                .all()
+            )
+            if len(recent) < RECENT_MESSAGES:
+                return
+            llm = ChatOllama(
+                model="llama3.2",
+                temperature=0,
+            )
+            while True:
+                to_fold = (
+                    Message.query
+                    .filter(
+                        Message.conversationId == conversation_id,
+                        Message.id > (conversation.summarizedUntil or 0),
+                        Message.id < recent[-1].id,
+                    )
+                    .order_by(Message.id)
+                    .limit(SUMMARY_BATCH_SIZE)
+                    .all()
+                )
+                if not to_fold:
+                    break
+                summary_prompt = SUMMARY_PROMPT.format(
+                    summary=conversation.summary or "No summary yet.",
+                    messages=format_messages(to_fold),
+                )
+                conversation.summary = llm.invoke(summary_prompt).content.strip()
+                conversation.summarizedUntil = to_fold[-1].id
+                db.session.commit()
+    except Exception as e:
+        print(f"failed to update the summary of conversation {conversation_id}: {e}")
+    finally:
+        with _pending_lock:
+            _pending.discard(conversation_id)
@@ -1,9 +1,14 @@
 
+import os
 from __main__ import app, db
-from utils.hash import compute_hash
+from utils.hash import compute_file_hash, file_fingerprint, hash_algorithm_of, DEFAULT_ALGORITHM
 from flask import request, jsonify
+from sqlalchemy import delete, insert, select, update
 from sqlalchemy.exc import IntegrityError
 
+# ids per IN (...) clause, below SQLite's limit on bound parameters
+BATCH_SIZE = 500
+
 
 class File(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -11,6 +16,14 @@ class File(db.Model):
     path = db.Column(db.String(120), nullable=False)
     userId = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     processed = db.Column(db.Boolean, default=False)
+    # stat fingerprint of the file when it was last hashed
+    size = db.Column(db.BigInteger, nullable=True)
+    mtimeNs = db.Column(db.BigInteger, nullable=True)
+    inode = db.Column(db.BigInteger, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_file_userId_path', 'userId', 'path'),
+    )
 
     def to_dict(self):
         return {
@@ -34,43 +47,39 @@ class File(db.Model):
             return False
         return self.hash == other.hash
     
-def create_file(file_path, user_id):
-    try:
-        # Validate input
-        if not file_path or not user_id:
-            raise RuntimeError('Path, and userId are required')
-
-        file_hash = compute_hash(file_path)
-
-        # Check if a file with the same hash and userId exists
-        existing_file = File.query.filter_by(userId=user_id, path=file_path).first()
-
-        if existing_file:
-            if file_hash != existing_file.hash:
-                # Update the existing file's attributes
-                existing_file.hash = file_hash
-                existing_file.processed = False  # Reset 'processed' status if needed
-                db.session.commit()
-                return existing_file  # Return the updated file object
-            else:
-                return existing_file
-        else:
-            # Create and add a new file
-            new_file = File(
-                hash=file_hash,
-                path=file_path,
-                userId=user_id
-            )
-            db.session.add(new_file)
-            db.session.commit()
-            return new_file  # Return the newly created file object
-    
-    except IntegrityError as e:
-        db.session.rollback()
-        raise RuntimeError(f"Integrity error occurred: {e}")
-    except Exception as e:
-        db.session.rollback()
-        raise RuntimeError(f"An unexpected error occurred: {e}")
+class FileChunk(db.Model):
+    """
+    Manifest entry of a chunk of a file currently stored in the vector db.
+    """
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    fileId = db.Column(db.Integer, db.ForeignKey('file.id'), nullable=False, index=True)
+    chunkId = db.Column(db.String(64), nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'fileId': self.fileId,
+            'chunkId': self.chunkId
+        }
+
+def refresh_hash(file_path, stored_hash, fingerprint_changed):
+    """
+    Re-hashes a known file whose fingerprint changed or whose hash is not of DEFAULT_ALGORITHM.
+    A legacy hash is compared in its own algorithm, then replaced by a DEFAULT_ALGORITHM one,
+    so legacy rows move to the default algorithm as their files are next reconciled.
+
+    Returns:
+        tuple[str, bool]: The hash to store and whether the contents changed
+    """
+    algorithm = hash_algorithm_of(stored_hash)
+    file_hash, contents_changed = stored_hash, False
+    if fingerprint_changed:
+        # hash with the algorithm of the stored hash so that the two can be compared
+        file_hash = compute_file_hash(file_path, algorithm)
+        contents_changed = file_hash != stored_hash
+    if algorithm != DEFAULT_ALGORITHM:
+        file_hash = compute_file_hash(file_path, DEFAULT_ALGORITHM)
+    return file_hash, contents_changed
 
 # Get files by userid
 def get_files_by_user_id(userId):
@@ -84,36 +93,153 @@ def get_files_by_user_id(userId):
         db.session.rollback()
         raise RuntimeError(f"An unexpected error occurred: {e}")
     
-def updateProcces(id):
+def _batches(items):
+    items = list(items)
+    for start in range(0, len(items), BATCH_SIZE):
+        yield items[start:start + BATCH_SIZE]
+
+def _file_row_to_dict(row):
+    # same keys as File.to_dict
+    return {
+        'id': row.id,
+        'hash': row.hash,
+        'path': row.path,
+        'userId': row.userId,
+        'processed': row.processed
+    }
+
+def reconcile_files(user_id, file_paths, on_delete=None, on_progress=None, partial=False):
+    """
+    Brings the File table of a user in line with the files on disk in a single transaction.
+
+    Files are only hashed when their (size, mtime, inode) changed, or once to replace
+    a legacy sha256 hash. New files are inserted, changed files get their new hash and
+    are marked unprocessed, and rows of files missing from disk are deleted along with
+    their chunk manifests.
+
+    Args:
+        user_id (int): The id of the user
+        file_paths (set[str]): The paths of the files currently on disk, or the changed paths when partial
+        on_delete (callable): Called with each deleted file (as a dict) before the rows are deleted
+        on_progress (callable): Called with the number of files checked so far
+        partial (bool): Only reconcile the given paths, the rows of other files are left as they are
+
+    Returns:
+        tuple[list[dict], list[dict]]: The remaining files and the deleted files
+    """
     try:
-        file = File.query.get(id)
-        if file:
-            file.processed = True
-            db.session.commit()
-            return file.to_dict()
+        # plain rows rather than ORM objects: on_progress may commit, which would expire them
+        # and reload each one with its own query
+        existing_files = {
+            row.path: row for row in db.session.execute(
+                select(
+                    File.id, File.hash, File.path, File.userId, File.processed,
+                    File.size, File.mtimeNs, File.inode,
+                ).where(File.userId == user_id)
+            ).all()
+        }
+
+        file_paths = set(file_paths)
+        if partial:
+            missing_paths = {file_path for file_path in file_paths if not os.path.isfile(file_path)}
+            file_paths -= missing_paths
+            deleted_files = [_file_row_to_dict(file) for path, file in existing_files.items() if path in missing_paths]
         else:
-            raise RuntimeError('File not found')
+            deleted_files = [_file_row_to_dict(file) for path, file in existing_files.items() if path not in file_paths]
+
+        inserts, updates = [], []
+        for checked, file_path in enumerate(file_paths, start=1):
+            try:
+                size, mtime_ns, inode = file_fingerprint(file_path)
+            except FileNotFoundError:
+                # removed since the folder was walked, e.g. by a concurrent upload
+                if file_path in existing_files:
+                    deleted_files.append(_file_row_to_dict(existing_files[file_path]))
+                if on_progress:
+                    on_progress(checked)
+                continue
+            existing_file = existing_files.get(file_path)
+            if existing_file is None:
+                inserts.append({
+                    'hash': compute_file_hash(file_path, DEFAULT_ALGORITHM),
+                    'path': file_path,
+                    'userId': user_id,
+                    'processed': False,
+                    'size': size,
+                    'mtimeNs': mtime_ns,
+                    'inode': inode,
+                })
+            else:
+                fingerprint_changed = (existing_file.size, existing_file.mtimeNs, existing_file.inode) != (size, mtime_ns, inode)
+                if fingerprint_changed or hash_algorithm_of(existing_file.hash) != DEFAULT_ALGORITHM:
+                    file_hash, contents_changed = refresh_hash(file_path, existing_file.hash, fingerprint_changed)
+                    changes = {'id': existing_file.id, 'size': size, 'mtimeNs': mtime_ns, 'inode': inode}
+                    if file_hash != existing_file.hash:
+                        changes['hash'] = file_hash
+                    if contents_changed:
+                        changes['processed'] = False
+                    updates.append(changes)
+            if on_progress:
+                on_progress(checked)
+
+        if on_delete:
+            for file in deleted_files:
+                on_delete(file)
+
+        if inserts:
+            db.session.execute(insert(File), inserts)
+        # rows with the same keys are updated together
+        for keys in {tuple(sorted(changes)) for changes in updates}:
+            db.session.execute(update(File), [changes for changes in updates if tuple(sorted(changes)) == keys])
+        for ids in _batches(file['id'] for file in deleted_files):
+            db.session.execute(delete(FileChunk).where(FileChunk.fileId.in_(ids)))
+            db.session.execute(delete(File).where(File.id.in_(ids)))
+        db.session.commit()
+
+        return get_files_by_user_id(user_id), deleted_files
     except IntegrityError as e:
         db.session.rollback()
         raise RuntimeError(f"Integrity error occurred: {e}")
     except Exception as e:
         db.session.rollback()
         raise RuntimeError(f"An unexpected error occurred: {e}")
-    
-# delete document from table and vector db
-def delete_documents_by_id(id):
+
+def get_chunk_ids_by_file_ids(file_ids):
+    """
+    Returns the chunk manifests of several files, keyed by file id.
+    """
     try:
-        file = File.query.get(id)
-        if file:
-            db.session.delete(file)
-            db.session.commit()
-        else:
-            raise RuntimeError('File not found')
+        manifests = {file_id: set() for file_id in file_ids}
+        for ids in _batches(file_ids):
+            for chunk in FileChunk.query.filter(FileChunk.fileId.in_(ids)).all():
+                manifests[chunk.fileId].add(chunk.chunkId)
+        return manifests
+    except Exception as e:
+        db.session.rollback()
+        raise RuntimeError(f"An unexpected error occurred: {e}")
+
+def complete_processing(manifests):
+    """
+    Stores the chunk manifests of processed files and marks them processed in a single transaction.
+
+    Args:
+        manifests (dict[int, list[str]]): The chunk ids of each processed file, keyed by file id
+    """
+    try:
+        for ids in _batches(manifests):
+            db.session.execute(delete(FileChunk).where(FileChunk.fileId.in_(ids)))
+            db.session.execute(update(File).where(File.id.in_(ids)).values(processed=True))
+        rows = [
+            {'fileId': file_id, 'chunkId': chunk_id}
+            for file_id, chunk_ids in manifests.items()
+            for chunk_id in set(chunk_ids)
+        ]
+        if rows:
+            db.session.execute(insert(FileChunk), rows)
+        db.session.commit()
     except IntegrityError as e:
         db.session.rollback()
         raise RuntimeError(f"Integrity error occurred: {e}")
     except Exception as e:
         db.session.rollback()
         raise RuntimeError(f"An unexpected error occurred: {e}")
-
-    
\ No newline at end of file
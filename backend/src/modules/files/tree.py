@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+
+from utils.cache import LRUCache
+from utils.metrics import register_stats
+
+# uploads and ingestion invalidate a user's tree, the TTL catches changes made outside the app
+FILE_TREE_TTL_SECONDS = 300
+
+file_tree_cache = LRUCache(max_entries=1024, ttl_seconds=FILE_TREE_TTL_SECONDS)
+register_stats('fileTree', file_tree_cache.stats)
+
+
+def build_directory_structure(path):
+    """
+    Builds the tree of a folder with one os.scandir pass per folder, hidden files and folders are skipped.
+
+    Returns:
+        dict: The name, files and subdirectories of the folder
+    """
+    structure = {
+        "name": os.path.basename(path),
+        "files": [],
+        "subdirectories": []
+    }
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name[0] == '.':
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                structure["subdirectories"].append(build_directory_structure(entry.path))
+            elif entry.is_file():
+                structure["files"].append({"name": entry.name})
+    return structure
+
+
+def get_file_tree(user_id):
+    """
+    Returns the tree of a user's data folder and its ETag, built on the first call
+    and then served from the cache until it is invalidated.
+
+    Returns:
+        tuple[dict, str]: The tree and its ETag, (None, None) if the user has no data folder
+    """
+    cached = file_tree_cache.get(user_id)
+    if cached:
+        return cached
+
+    folder_path = f"files/{user_id}/data"
+    if not os.path.isdir(folder_path):
+        return None, None
+    tree = build_directory_structure(folder_path)
+    etag = hashlib.blake2b(json.dumps(tree, sort_keys=True).encode(), digest_size=16).hexdigest()
+    file_tree_cache.set(user_id, (tree, etag))
+    return tree, etag
+
+
+def invalidate_file_tree(user_id):
+    file_tree_cache.pop(int(user_id), None)
@@ -0,0 +1,191 @@
+import os
+import re
+import threading
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from utils.metrics import register_stats
+
+CHUNK_SIZE_TOKENS = 256
+# share of a chunk repeated at the start of the next one
+CHUNK_OVERLAP_RATIO = 0.1
+
+# how the elements of a file are grouped into sections before they are split
+STRATEGIES = {
+    '.md': 'headings',
+    '.markdown': 'headings',
+    '.docx': 'headings',
+    '.doc': 'headings',
+    '.html': 'headings',
+    '.htm': 'headings',
+    '.pdf': 'pages',
+    '.pptx': 'pages',
+    '.ppt': 'pages',
+}
+DEFAULT_STRATEGY = 'text'
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+_stats_lock = threading.Lock()
+_stats = {
+    'runs': 0,
+    'lastRun': None,
+}
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximates the number of tokens of a text by counting words and punctuation marks.
+    """
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+class ChunkingRun:
+    """
+    Accumulates the chunk amplification of one ingest run.
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.source_bytes = 0
+        self.chunks = 0
+        self.embedded_bytes = 0
+
+    def add(self, elements: list[Document], chunks: list[Document]) -> None:
+        self.files += len({element.metadata.get('source') for element in elements})
+        self.source_bytes += sum(len(element.page_content.encode('utf-8')) for element in elements)
+        self.chunks += len(chunks)
+        self.embedded_bytes += sum(len(chunk.page_content.encode('utf-8')) for chunk in chunks)
+
+    def to_dict(self) -> dict:
+        return {
+            'files': self.files,
+            'sourceBytes': self.source_bytes,
+            'chunks': self.chunks,
+            'embeddedBytes': self.embedded_bytes,
+            'chunksPerKB': self.chunks / (self.source_bytes / 1024) if self.source_bytes else 0.0,
+            'amplification': self.embedded_bytes / self.source_bytes if self.source_bytes else 0.0,
+        }
+
+
+def record_run(run: ChunkingRun) -> None:
+    with _stats_lock:
+        _stats['runs'] += 1
+        _stats['lastRun'] = run.to_dict()
+
+
+def stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def strategy_for(source: str) -> str:
+    return STRATEGIES.get(os.path.splitext(source or '')[1].lower(), DEFAULT_STRATEGY)
+
+
+def _sections_by_heading(elements: list[Document]) -> list[list[Document]]:
+    sections = [[]]
+    for element in elements:
+        if element.metadata.get('category') == 'Title' and sections[-1]:
+            sections.append([])
+        sections[-1].append(element)
+    return sections
+
+
+def _sections_by_page(elements: list[Document]) -> list[list[Document]]:
+    sections = [[]]
+    for element in elements:
+        page = element.metadata.get('page_number')
+        if sections[-1] and page != sections[-1][-1].metadata.get('page_number'):
+            sections.append([])
+        sections[-1].append(element)
+    return sections
+
+
+def _section_document(section: list[Document]) -> Document:
+    first = section[0]
+    metadata = {'source': first.metadata.get('source')}
+    if first.metadata.get('page_number') is not None:
+        metadata['page_number'] = first.metadata['page_number']
+    if first.metadata.get('category') == 'Title':
+        metadata['section'] = first.page_content
+    return Document(
+        page_content="\n\n".join(element.page_content for element in section),
+        metadata=metadata,
+    )
+
+
+def make_splitter(chunk_size: int = CHUNK_SIZE_TOKENS, overlap_ratio: float = CHUNK_OVERLAP_RATIO) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=int(chunk_size * overlap_ratio),
+        length_function=count_tokens,
+        is_separator_regex=False,
+    )
+
+
+def _locate_chunks(section: Document, texts: list[str]) -> list[Document]:
+    """
+    Turns the chunks of a section into documents carrying their character offset in it
+    as start_index, which lets overlapping chunks be merged exactly at query time.
+    The splitter's own add_start_index mixes its token overlap into character offsets.
+    """
+    chunks, search_from = [], 0
+    for text in texts:
+        start = section.page_content.find(text, search_from)
+        if start == -1:
+            start = section.page_content.find(text)
+        metadata = dict(section.metadata)
+        if start != -1:
+            metadata['start_index'] = start
+            search_from = start + 1
+        chunks.append(Document(page_content=text, metadata=metadata))
+    return chunks
+
+
+def chunk_documents(
+    documents: list[Document],
+    run: ChunkingRun = None,
+    chunk_size: int = CHUNK_SIZE_TOKENS,
+    overlap_ratio: float = CHUNK_OVERLAP_RATIO,
+) -> list[Document]:
+    """
+    Function that groups the parsed elements of each file into sections according to
+    its file type (headings, pages or the whole text) and splits them into token sized chunks.
+
+    Args:
+        documents (list[Document]): The elements returned by the loader
+        run (ChunkingRun): Optional run receiving the amplification of these documents
+        chunk_size (int): The maximum number of tokens of a chunk
+        overlap_ratio (float): The overlap between consecutive chunks, as a share of chunk_size
+
+    Returns:
+        list[Document]: The chunks, in document order
+    """
+    elements_by_source = {}
+    for document in documents:
+        if document.page_content.strip():
+            elements_by_source.setdefault(document.metadata.get('source'), []).append(document)
+
+    sections = []
+    for source, elements in elements_by_source.items():
+        strategy = strategy_for(source)
+        if strategy == 'headings':
+            grouped = _sections_by_heading(elements)
+        elif strategy == 'pages':
+            grouped = _sections_by_page(elements)
+        else:
+            grouped = [elements]
+        sections.extend(_section_document(section) for section in grouped if section)
+
+    splitter = make_splitter(chunk_size, overlap_ratio)
+    chunks = []
+    for section in sections:
+        chunks.extend(_locate_chunks(section, splitter.split_text(section.page_content)))
+    if run is not None:
+        run.add(documents, chunks)
+    return chunks
+
+
+register_stats('chunking', stats)
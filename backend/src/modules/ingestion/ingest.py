@@ -0,0 +1,142 @@
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Callable, Iterable, Optional
+
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from utils.metrics import register_stats
+
+BATCH_SIZE = 32
+MAX_WORKERS = 4
+# Batches embedded but not yet written, bounds the vectors held in memory
+MAX_PENDING_BATCHES = 8
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='embed')
+
+_stats_lock = threading.Lock()
+_stats = {
+    'runs': 0,
+    'chunks': 0,
+    'seconds': 0.0,
+    'lastRun': None,
+}
+
+
+def batched(documents: Iterable[Document], batch_size: int):
+    iterator = iter(documents)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def write_batch(vectorstore: Chroma, documents: list[Document], embeddings: list[list[float]], ids: list[str]) -> None:
+    """
+    Writes one embedded batch to the Chroma collection in a single call.
+
+    Chroma rejects empty metadata dicts, so documents without metadata are written separately.
+    """
+    collection = vectorstore._collection
+    with_metadata = [i for i, doc in enumerate(documents) if doc.metadata]
+    without_metadata = [i for i, doc in enumerate(documents) if not doc.metadata]
+    if with_metadata:
+        collection.upsert(
+            ids=[ids[i] for i in with_metadata],
+            embeddings=[embeddings[i] for i in with_metadata],
+            metadatas=[documents[i].metadata for i in with_metadata],
+            documents=[documents[i].page_content for i in with_metadata],
+        )
+    if without_metadata:
+        collection.upsert(
+            ids=[ids[i] for i in without_metadata],
+            embeddings=[embeddings[i] for i in without_metadata],
+            documents=[documents[i].page_content for i in without_metadata],
+        )
+
+
+def embed_and_store(
+    vectorstore: Chroma,
+    embeddings: Embeddings,
+    documents: Iterable[Document],
+    ids: Optional[Iterable[str]] = None,
+    batch_size: int = BATCH_SIZE,
+    max_pending: int = MAX_PENDING_BATCHES,
+    on_progress: Optional[Callable[[int], None]] = None,
+) -> dict:
+    """
+    Function that embeds documents in batches on the shared worker pool and writes
+    each batch to Chroma as soon as it is done.
+
+    At most `max_pending` batches are in flight, further documents are only pulled
+    from `documents` once a batch has been written, which keeps memory flat for
+    large inputs.
+
+    Args:
+        vectorstore (Chroma): The vector store to write to
+        embeddings (Embeddings): The embedding model
+        documents (Iterable[Document]): The documents to embed, consumed lazily
+        ids (Iterable[str]): Optional ids of the documents, in the same order
+        batch_size (int): The number of documents per embedding call
+        max_pending (int): The number of batches allowed in flight
+        on_progress (Callable[[int], None]): Called with the number of chunks written so far
+
+    Returns:
+        dict: The number of chunks written, the time taken and the chunks per second
+    """
+    id_iterator = iter(ids) if ids is not None else None
+    start = time.perf_counter()
+    written = 0
+    pending = {}
+
+    def drain(return_when):
+        nonlocal written
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            batch, batch_ids = pending.pop(future)
+            write_batch(vectorstore, batch, future.result(), batch_ids)
+            written += len(batch)
+            if on_progress:
+                on_progress(written)
+
+    try:
+        for batch in batched(documents, batch_size):
+            if id_iterator is not None:
+                batch_ids = [next(id_iterator) for _ in batch]
+            else:
+                batch_ids = [str(uuid.uuid4()) for _ in batch]
+            future = _executor.submit(embeddings.embed_documents, [doc.page_content for doc in batch])
+            pending[future] = (batch, batch_ids)
+            if len(pending) >= max_pending:
+                drain(FIRST_COMPLETED)
+        while pending:
+            drain(FIRST_COMPLETED)
+    finally:
+        for future in pending:
+            future.cancel()
+
+    seconds = time.perf_counter() - start
+    run = {
+        'chunks': written,
+        'seconds': seconds,
+        'chunksPerSecond': written / seconds if seconds else 0.0,
+    }
+    with _stats_lock:
+        _stats['runs'] += 1
+        _stats['chunks'] += written
+        _stats['seconds'] += seconds
+        _stats['lastRun'] = run
+    return run
+
+
+def stats() -> dict:
+    with _stats_lock:
+        return {
+            **_stats,
+            'chunksPerSecond': _stats['chunks'] / _stats['seconds'] if _stats['seconds'] else 0.0,
+        }
+
+
+register_stats('embedding', stats)
@@ -0,0 +1,100 @@
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, NamedTuple, Optional
+
+from langchain_core.documents import Document
+
+MAX_WORKERS = os.cpu_count() or 1
+PARSE_TIMEOUT_SECONDS = 300
+# the pool is started from a job worker while other threads hold locks, forking this process
+# could copy those locks held into the workers, so workers are forked from a clean server process
+START_METHOD = 'forkserver'
+
+_pool_lock = threading.Lock()
+_pool = None
+
+
+class ParseResult(NamedTuple):
+    path: str
+    documents: list[Document]
+    error: Optional[str]
+
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError
+
+
+def _load_file(path: str, timeout: int) -> list[Document]:
+    """
+    Runs in a worker process, partitions a single file with the UnstructuredLoader.
+    """
+    from langchain_unstructured import UnstructuredLoader
+
+    # the alarm interrupts a parser stuck on a single file without killing the worker
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    signal.alarm(timeout)
+    try:
+        return UnstructuredLoader([path]).load()
+    finally:
+        signal.alarm(0)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context(START_METHOD))
+        return _pool
+
+
+def _reset_pool(broken: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_files(file_paths: list[str], timeout: int = PARSE_TIMEOUT_SECONDS) -> Iterator[ParseResult]:
+    """
+    Function that parses files on a process pool and yields each file as soon as it is done.
+
+    A file that fails or exceeds `timeout` seconds is yielded with an error instead
+    of documents. If a worker dies, the pool is replaced and the files that were in
+    flight are retried once.
+
+    Args:
+        file_paths (list[str]): The paths of the files to parse
+        timeout (int): The maximum number of seconds spent on a single file
+
+    Returns:
+        Iterator[ParseResult]: The path, documents and error of each file, in completion order
+    """
+    queue = [(path, 0) for path in file_paths]
+    while queue:
+        pool = _get_pool()
+        pending = {pool.submit(_load_file, path, timeout): (path, attempt) for path, attempt in queue}
+        queue = []
+        broken = False
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, attempt = pending.pop(future)
+                try:
+                    yield ParseResult(path, future.result(), None)
+                except BrokenProcessPool:
+                    broken = True
+                    if attempt == 0:
+                        queue.append((path, attempt + 1))
+                    else:
+                        yield ParseResult(path, [], 'the parser process crashed')
+                except TimeoutError:
+                    yield ParseResult(path, [], f'parsing took longer than {timeout} seconds')
+                except Exception as e:
+                    yield ParseResult(path, [], str(e))
+        if broken:
+            _reset_pool(pool)
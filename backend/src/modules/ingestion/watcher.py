@@ -0,0 +1,206 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+import time
+
+from utils.metrics import register_stats
+
+# a user's changes are sent once no event arrived for this long...
+DEBOUNCE_SECONDS = 2.0
+# ...or once they have been pending for this long, whichever comes first
+MAX_DELAY_SECONDS = 30.0
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event: wd, mask, cookie, len, followed by the name padded to len bytes
+_EVENT_HEADER = struct.Struct('iIII')
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+class FileWatcher:
+    """
+    Watches files/<userId>/data with inotify and reports the changed paths of each user
+    once their events settle. Changes that cannot be narrowed down to paths (a directory
+    moved in or out, an overflowed event queue) are reported as None, a full scan.
+
+    Args:
+        root (str): The directory holding one folder per user
+        on_changes (callable): Called with (userId, paths) where paths is a list of paths or None
+    """
+
+    def __init__(self, root, on_changes, debounce_seconds=DEBOUNCE_SECONDS, max_delay_seconds=MAX_DELAY_SECONDS):
+        self.root = os.path.abspath(root)
+        self.on_changes = on_changes
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._libc = None
+        self._fd = None
+        self._watches = {}
+        self._pending = {}          # userId -> [paths or None, first event, last event]
+        self._thread = None
+        self._events = 0
+        self._flushes = 0
+
+    def start(self):
+        """
+        Starts watching on a background thread.
+
+        Raises:
+            OSError: If inotify is not available
+        """
+        libc_name = ctypes.util.find_library('c')
+        if not libc_name:
+            raise OSError('libc not found, inotify is not available')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError('inotify is not available on this platform')
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        os.makedirs(self.root, exist_ok=True)
+        self._watch_tree(self.root)
+        self._thread = threading.Thread(target=self._run, name='file-watcher', daemon=True)
+        self._thread.start()
+
+    def stats(self) -> dict:
+        return {
+            'watches': len(self._watches),
+            'events': self._events,
+            'flushes': self._flushes,
+            'pendingUsers': len(self._pending),
+        }
+
+    def _watch_tree(self, path):
+        for directory, _, _ in os.walk(path):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+            if wd >= 0:
+                self._watches[wd] = directory
+
+    def _user_of(self, path):
+        # only files under <root>/<userId>/data are ingested
+        parts = os.path.relpath(path, self.root).split(os.sep)
+        if len(parts) < 3 or not parts[0].isdigit() or parts[1] != 'data':
+            return None
+        return int(parts[0])
+
+    def _mark(self, user_id, path):
+        now = time.monotonic()
+        pending = self._pending.setdefault(user_id, [set(), now, now])
+        pending[2] = now
+        if pending[0] is None:
+            return
+        if path is None:
+            pending[0] = None
+        else:
+            pending[0].add(path)
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # events were dropped, every user with a data folder needs a full scan
+            for entry in os.scandir(self.root):
+                if entry.name.isdigit():
+                    self._mark(int(entry.name), None)
+            return
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+        directory = self._watches.get(wd)
+        if directory is None or not name:
+            return
+
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(path)
+            if mask & IN_CREATE:
+                # files written before the watches were added raise no event of their own
+                for file_directory, _, files in os.walk(path):
+                    for file in files:
+                        file_path = os.path.join(file_directory, file)
+                        user_id = self._user_of(file_path)
+                        if user_id is not None:
+                            self._mark(user_id, file_path)
+            elif mask & (IN_MOVED_TO | IN_MOVED_FROM):
+                # the files of a moved directory are not reported one by one
+                user_id = self._user_of(os.path.join(path, '_'))
+                if user_id is not None:
+                    self._mark(user_id, None)
+            return
+
+        user_id = self._user_of(path)
+        if user_id is not None and mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE):
+            self._mark(user_id, path)
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            self._events += 1
+            self._handle(wd, mask, name)
+
+    def _flush(self):
+        now = time.monotonic()
+        for user_id, (paths, first, last) in list(self._pending.items()):
+            if now - last < self.debounce_seconds and now - first < self.max_delay_seconds:
+                continue
+            del self._pending[user_id]
+            self._flushes += 1
+            try:
+                self.on_changes(user_id, sorted(paths) if paths is not None else None)
+            except Exception as e:
+                print(f"failed to queue the changes of user {user_id}: {e}")
+
+    def _run(self):
+        while True:
+            ready, _, _ = select.select([self._fd], [], [], 0.5)
+            if ready:
+                self._read_events()
+            self._flush()
+
+
+def start_file_watcher(root='./files'):
+    """
+    Starts the file watcher once per process. Each settled batch of changes queues a
+    processing job restricted to the changed paths. Does nothing if inotify is not
+    available, /process/<id> keeps working either way.
+    """
+    global _watcher
+    from __main__ import app
+    from jobs.job import enqueue_job
+
+    def on_changes(user_id, paths):
+        with app.app_context():
+            enqueue_job(user_id, paths)
+
+    with _watcher_lock:
+        if _watcher:
+            return
+        watcher = FileWatcher(root, on_changes)
+        try:
+            watcher.start()
+        except OSError as e:
+            print(f"file watcher disabled: {e}")
+            return
+        _watcher = watcher
+        register_stats('watcher', watcher.stats)
@@ -0,0 +1,294 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import jsonify
+from sqlalchemy import select, update
+
+from __main__ import app, db
+from users.user import authorize_user
+
+JOB_WORKERS = 2
+POLL_INTERVAL_SECONDS = 5
+# progress is written to the table at most this often
+PROGRESS_COMMIT_INTERVAL_SECONDS = 1
+# a running job whose lease was not renewed for this long is considered abandoned
+JOB_LEASE_SECONDS = 60
+LEASE_RENEW_INTERVAL_SECONDS = JOB_LEASE_SECONDS / 3
+# identifies the running jobs of this process
+WORKER_ID = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+_handler = None
+_workers = []
+_workers_lock = threading.Lock()
+_enqueue_lock = threading.Lock()
+_wakeup = threading.Condition()
+
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    userId = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)   # queued, running, done, failed
+    stage = db.Column(db.String(20), nullable=True)                                    # hashing, parsing, embedding
+    filesTotal = db.Column(db.Integer, default=0)
+    filesHashed = db.Column(db.Integer, default=0)
+    filesToParse = db.Column(db.Integer, default=0)
+    filesParsed = db.Column(db.Integer, default=0)
+    chunksToEmbed = db.Column(db.Integer, default=0)
+    chunksEmbedded = db.Column(db.Integer, default=0)
+    # JSON list of the changed paths to process, null for a full scan of the user's files
+    paths = db.Column(db.Text, nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    # process running the job and until when it holds it, renewed while the process is alive
+    owner = db.Column(db.String(120), nullable=True)
+    leaseUntil = db.Column(db.DateTime, nullable=True)
+    createdAt = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    startedAt = db.Column(db.DateTime, nullable=True)
+    stageStartedAt = db.Column(db.DateTime, nullable=True)
+    finishedAt = db.Column(db.DateTime, nullable=True)
+
+    def stage_progress(self):
+        if self.stage == 'hashing':
+            return self.filesHashed or 0, self.filesTotal or 0
+        if self.stage == 'parsing':
+            return self.filesParsed or 0, self.filesToParse or 0
+        if self.stage == 'embedding':
+            return self.chunksEmbedded or 0, self.chunksToEmbed or 0
+        return 0, 0
+
+    def eta_seconds(self):
+        """
+        Estimated seconds left in the current stage, based on the rate so far.
+        """
+        done, total = self.stage_progress()
+        if self.status != 'running' or not self.stageStartedAt or not done:
+            return None
+        elapsed = (datetime.now() - self.stageStartedAt).total_seconds()
+        return elapsed / done * max(total - done, 0)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'userId': self.userId,
+            'status': self.status,
+            'stage': self.stage,
+            'filesTotal': self.filesTotal,
+            'filesHashed': self.filesHashed,
+            'filesToParse': self.filesToParse,
+            'filesParsed': self.filesParsed,
+            'chunksToEmbed': self.chunksToEmbed,
+            'chunksEmbedded': self.chunksEmbedded,
+            'paths': len(json.loads(self.paths)) if self.paths else None,
+            'etaSeconds': self.eta_seconds(),
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'createdAt': self.createdAt.isoformat() if self.createdAt else None,
+            'startedAt': self.startedAt.isoformat() if self.startedAt else None,
+            'finishedAt': self.finishedAt.isoformat() if self.finishedAt else None
+        }
+
+
+class JobProgress:
+    """
+    Handed to the job handler to report the stage and counters of a running job.
+    """
+
+    def __init__(self, job: Job):
+        self.job = job
+        self._last_commit = 0.0
+
+    def stage(self, stage, **counters):
+        self.job.stage = stage
+        self.job.stageStartedAt = datetime.now()
+        self.update(force=True, **counters)
+
+    def update(self, force=False, **counters):
+        for name, value in counters.items():
+            setattr(self.job, name, value)
+        now = time.monotonic()
+        if force or now - self._last_commit >= PROGRESS_COMMIT_INTERVAL_SECONDS:
+            db.session.commit()
+            self._last_commit = now
+
+
+def register_job_handler(handler):
+    """
+    Sets the function run for each job, called as handler(userId, progress, paths)
+    where paths is the list of changed paths, or None for a full scan.
+    Its return value is stored as the job result.
+    """
+    global _handler
+    _handler = handler
+
+
+def enqueue_job(user_id, paths=None):
+    """
+    Queues a processing job for a user. A job already waiting for the same user is
+    returned instead of queueing a duplicate, with the changed paths merged into it.
+
+    Args:
+        user_id (int): The id of the user
+        paths (list[str]): The changed paths to process, None to scan all of the user's files
+
+    Returns:
+        Job: The queued job
+    """
+    with _enqueue_lock:
+        try:
+            job = Job.query.filter_by(userId=user_id, status='queued').first()
+            if not job:
+                job = Job(
+                    userId=user_id,
+                    status='queued',
+                    paths=json.dumps(sorted(set(paths))) if paths is not None else None,
+                    createdAt=datetime.now()
+                )
+                db.session.add(job)
+                db.session.commit()
+            elif job.paths is not None:
+                # a full scan covers any paths, otherwise process both sets of paths
+                job.paths = json.dumps(sorted(set(json.loads(job.paths)) | set(paths))) if paths is not None else None
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            raise RuntimeError(f"An unexpected error occurred: {e}")
+    start_job_workers()
+    with _wakeup:
+        _wakeup.notify()
+    return job
+
+
+def get_job_by_id(job_id):
+    try:
+        return Job.query.get(job_id)
+    except Exception as e:
+        return None
+
+
+def recover_stale_jobs():
+    """
+    Queues again the running jobs whose lease expired, their process died without
+    finishing them. Jobs still held by a live process are left alone.
+    Called at app startup and by the lease renewal thread of every process.
+
+    Returns:
+        int: The number of jobs queued again
+    """
+    try:
+        recovered = db.session.execute(
+            update(Job)
+            .where(Job.status == 'running', Job.leaseUntil < datetime.now())
+            .values(status='queued', owner=None, leaseUntil=None)
+        )
+        db.session.commit()
+        return recovered.rowcount
+    except Exception as e:
+        db.session.rollback()
+        raise RuntimeError(f"An unexpected error occurred: {e}")
+
+
+def start_job_workers():
+    """
+    Starts the worker threads, and the thread renewing the leases of their jobs, once per process.
+    """
+    with _workers_lock:
+        if _workers:
+            return
+        for i in range(JOB_WORKERS):
+            worker = threading.Thread(target=_work, name=f'job-worker-{i}', daemon=True)
+            worker.start()
+            _workers.append(worker)
+        heartbeat = threading.Thread(target=_renew_leases, name='job-heartbeat', daemon=True)
+        heartbeat.start()
+        _workers.append(heartbeat)
+
+
+def _lease_deadline():
+    return datetime.now() + timedelta(seconds=JOB_LEASE_SECONDS)
+
+
+def _renew_leases():
+    while True:
+        time.sleep(LEASE_RENEW_INTERVAL_SECONDS)
+        try:
+            with app.app_context():
+                db.session.execute(
+                    update(Job)
+                    .where(Job.status == 'running', Job.owner == WORKER_ID)
+                    .values(leaseUntil=_lease_deadline())
+                )
+                db.session.commit()
+                # the jobs of a process that died, a restart comes back before their lease expires
+                if recover_stale_jobs():
+                    with _wakeup:
+                        _wakeup.notify_all()
+        except Exception as e:
+            print(f"job lease renewal error: {e}")
+
+
+def _claim_next_job():
+    # one job per user at a time, a newer job waits for the running one unless its lease expired
+    running_users = select(Job.userId).where(Job.status == 'running', Job.leaseUntil >= datetime.now())
+    candidate = Job.query.filter(Job.status == 'queued', Job.userId.not_in(running_users)).order_by(Job.id).first()
+    if not candidate:
+        return None
+    claimed = db.session.execute(
+        update(Job)
+        .where(Job.id == candidate.id, Job.status == 'queued')
+        .values(status='running', startedAt=datetime.now(), owner=WORKER_ID, leaseUntil=_lease_deadline())
+    )
+    db.session.commit()
+    if claimed.rowcount != 1:
+        return None
+    db.session.refresh(candidate)
+    return candidate
+
+
+def _run_job(job):
+    try:
+        paths = json.loads(job.paths) if job.paths is not None else None
+        result = _handler(job.userId, JobProgress(job), paths)
+        job.status = 'done'
+        job.result = json.dumps(result)
+    except Exception as e:
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = str(e)
+    job.leaseUntil = None
+    job.finishedAt = datetime.now()
+    db.session.commit()
+
+
+def _work():
+    while True:
+        try:
+            with app.app_context():
+                job = _claim_next_job()
+                if job:
+                    _run_job(job)
+                    with _wakeup:
+                        _wakeup.notify_all()
+                    continue
+        except Exception as e:
+            print(f"job worker error: {e}")
+        with _wakeup:
+            _wakeup.wait(POLL_INTERVAL_SECONDS)
+
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        job = get_job_by_id(job_id)
+        if not job:
+            return jsonify({'error': f'Job with ID {job_id} not found'}), 404
+        authorize_user(job.userId)
+        return jsonify(job.to_dict()), 200
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except Exception as e:
+        return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
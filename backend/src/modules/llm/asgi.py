@@ -0,0 +1,147 @@
+import json
+import time
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from __main__ import app
+from llm.llm import (
+    authorize_question, build_answer_prompt, build_streaming_prompt, finish_contextualization,
+    parse_answer, prepare_answer, prepare_contextualization, sources_of, sse_event,
+)
+from llm.ollama_client import ollama_client
+from rag.answer_cache import answer_cache
+from rag.rag import retrieve
+
+
+async def in_app_context(fn, *args):
+    """
+    Runs a blocking function (database, embedding, vector search) on the thread pool,
+    inside a Flask app context, so that the event loop keeps serving other requests.
+    """
+    def call():
+        with app.app_context():
+            return fn(*args)
+    return await run_in_threadpool(call)
+
+
+async def contextualize_prompt_async(conversationId, prompt: str) -> str:
+    """
+    Async variant of contextualize_prompt, the reformulation is awaited on the shared Ollama client.
+    """
+    contextualized_prompt, cache_key, context_prompt = await in_app_context(prepare_contextualization, conversationId, prompt)
+    if contextualized_prompt is not None:
+        return contextualized_prompt
+    return finish_contextualization(cache_key, prompt, await ollama_client.chat(context_prompt))
+
+
+async def read_question(request):
+    """
+    Reads and checks the body of a question.
+
+    Returns:
+        tuple: The conversation id, the user, the prompt and an error response (None when the body is valid)
+    """
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        body = {}
+    conversationId = body.get('conversationId')
+    userId = body.get('userId')
+    prompt = body.get('prompt')
+    if not conversationId or not userId or not prompt:
+        return None, None, None, JSONResponse({'error': 'ConversationId, userId, and prompt are required'}, 400)
+    try:
+        user = await in_app_context(authorize_question, userId, conversationId, request.headers)
+    except PermissionError as e:
+        return None, None, None, JSONResponse({'error': str(e)}, 403)
+    if not user:
+        return None, None, None, JSONResponse(
+            {'error': f'User with id {userId} or conversation with id {conversationId} not found'}, 404
+        )
+    return conversationId, user, prompt, None
+
+
+async def answer_user_prompt(request):
+    conversationId, user, prompt, error = await read_question(request)
+    if error:
+        return error
+    contextualized_prompt = await contextualize_prompt_async(conversationId, prompt)
+
+    cached_answer, documents, query_embedding, corpus_version = await in_app_context(
+        prepare_answer, user.id, contextualized_prompt
+    )
+    if cached_answer is not None:
+        return JSONResponse({"answer": cached_answer})
+
+    answer = parse_answer(await ollama_client.chat(build_answer_prompt(user, contextualized_prompt, documents)))
+    answer_cache.set(user.id, query_embedding, answer, version=corpus_version, query=contextualized_prompt)
+
+    return JSONResponse({"answer": answer})
+
+
+async def stream_user_prompt(request):
+    """
+    Async variant of /answer/stream, sends the answer as Server-Sent Events.
+    """
+    start = time.perf_counter()
+    conversationId, user, prompt, error = await read_question(request)
+    if error:
+        return error
+
+    async def generate():
+        try:
+            contextualized_prompt = await contextualize_prompt_async(conversationId, prompt)
+            documents = await in_app_context(retrieve, user.id, contextualized_prompt)
+            formatted_prompt = build_streaming_prompt(user, contextualized_prompt, documents)
+
+            first_token = True
+            async for token in ollama_client.stream_chat(formatted_prompt):
+                if first_token:
+                    first_token = False
+                    print(f"time to first token: {time.perf_counter() - start:.2f}s")
+                yield sse_event({'token': token}, 'token')
+
+            yield sse_event({'sources': sources_of(documents)}, 'sources')
+            yield sse_event({}, 'done')
+        except Exception as e:
+            yield sse_event({'error': 'An error occurred', 'details': str(e)}, 'error')
+
+    return StreamingResponse(
+        generate(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+def create_asgi_app() -> Starlette:
+    """
+    Serves /answer and /answer/stream asynchronously, every other route is handed to
+    the Flask app, which runs on a thread pool as before.
+
+    The Flask app is bridged with a2wsgi rather than Starlette's deprecated WSGIMiddleware,
+    which reads the whole request body into memory before calling the app. a2wsgi feeds
+    the body to the app as it arrives, so uploads stream to disk as under the Flask server.
+    """
+    @asynccontextmanager
+    async def lifespan(_):
+        yield
+        await ollama_client.aclose()
+
+    return Starlette(
+        routes=[
+            Route('/answer', answer_user_prompt, methods=['POST']),
+            Route('/answer/stream', stream_user_prompt, methods=['POST']),
+            Mount('/', app=WSGIMiddleware(app)),
+        ],
+        middleware=[
+            Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        ],
+        lifespan=lifespan,
+    )
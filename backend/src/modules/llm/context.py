@@ -0,0 +1,162 @@
+import json
+import re
+import threading
+
+from langchain_core.documents import Document
+
+from ingestion.chunking import count_tokens
+from utils.metrics import register_stats
+
+CONTEXT_TOKEN_BUDGET = 1500
+# chunks sharing at least this share of their word shingles are treated as duplicates
+NEAR_DUPLICATE_SIMILARITY = 0.85
+# length of the start of a chunk looked up in the previous chunk to detect an overlap, for chunks
+# stored without their start_index. Kept short since the splitter may overlap chunks by a few words only
+OVERLAP_PROBE_CHARS = 16
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+_stats_lock = threading.Lock()
+_stats = {
+    'requests': 0,
+    'tokensBefore': 0,
+    'tokensAfter': 0,
+}
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = _WORD_PATTERN.findall(text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+
+
+def _merge(first: str, second: str):
+    """
+    Returns the two texts joined without their shared part, or None when they do not overlap.
+    """
+    if second in first:
+        return first
+    if first in second:
+        return second
+    probe = second[:OVERLAP_PROBE_CHARS]
+    index = first.find(probe)
+    while index != -1:
+        if second.startswith(first[index:]):
+            return first[:index] + second
+        index = first.find(probe, index + 1)
+    return None
+
+
+def _section_of(document: Document) -> tuple:
+    return document.metadata.get('source'), document.metadata.get('page_number'), document.metadata.get('section')
+
+
+def _merge_by_offset(first: Document, second: Document):
+    """
+    Joins two chunks of the same section using their start_index, returns the text and its
+    start_index, or None when they do not overlap or were stored without an offset.
+    """
+    first_start, second_start = first.metadata.get('start_index'), second.metadata.get('start_index')
+    if first_start is None or second_start is None or _section_of(first) != _section_of(second):
+        return None
+    # chunks stored with the splitter's offsets can hold -1
+    if first_start < 0 or second_start < 0:
+        return None
+    if second_start < first_start:
+        first, second, first_start, second_start = second, first, second_start, first_start
+    first_text, second_text = first.page_content, second.page_content
+    overlap = first_start + len(first_text) - second_start
+    if overlap <= 0:
+        return None
+    if overlap >= len(second_text):
+        # the second chunk lies within the first one
+        offset = second_start - first_start
+        return (first_text, first_start) if first_text[offset:offset + len(second_text)] == second_text else None
+    # sections with the same source, page and heading could still be different ones
+    if first_text[-overlap:] != second_text[:overlap]:
+        return None
+    return first_text + second_text[overlap:], first_start
+
+
+def merge_overlapping(documents: list[Document]) -> list[Document]:
+    """
+    Merges chunks of the same source that overlap, keeping the rank of the first one.
+    Chunks are joined at their start_index when it agrees with their text, otherwise
+    by looking for the start of one at the end of the other.
+    """
+    merged = []
+    for document in documents:
+        source = document.metadata.get('source')
+        for i, kept in enumerate(merged):
+            if kept.metadata.get('source') != source:
+                continue
+            by_offset = _merge_by_offset(kept, document)
+            if by_offset is not None:
+                text, start_index = by_offset
+                merged[i] = Document(page_content=text, metadata={**kept.metadata, 'start_index': start_index})
+                break
+            text = _merge(kept.page_content, document.page_content) or _merge(document.page_content, kept.page_content)
+            if text is not None:
+                merged[i] = Document(page_content=text, metadata=kept.metadata)
+                break
+        else:
+            merged.append(document)
+    return merged
+
+
+def remove_near_duplicates(documents: list[Document]) -> list[Document]:
+    kept, kept_shingles = [], []
+    for document in documents:
+        shingles = _shingles(document.page_content)
+        if any(len(shingles & other) / len(shingles | other) >= NEAR_DUPLICATE_SIMILARITY for other in kept_shingles):
+            continue
+        kept.append(document)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def pack_context(documents: list[Document], token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """
+    Function that assembles the retrieved documents into the prompt context.
+
+    Overlapping chunks of the same source are merged, near-duplicates are dropped and
+    the remaining chunks are added in rank order while they fit in the token budget,
+    a chunk too large for what is left is skipped in favour of smaller ones after it.
+    Each chunk is written as its source path followed by its content.
+
+    Args:
+        documents (list[Document]): The retrieved documents, best first
+        token_budget (int): The maximum number of tokens of the context
+
+    Returns:
+        str: The context to put in the prompt
+    """
+    sections, used = [], 0
+    for document in remove_near_duplicates(merge_overlapping(documents)):
+        section = f"[{len(sections) + 1}] source: {document.metadata.get('source', 'Unknown')}\n{document.page_content.strip()}"
+        tokens = count_tokens(section)
+        if sections and used + tokens > token_budget:
+            continue
+        sections.append(section)
+        used += tokens
+    context = "\n\n".join(sections)
+
+    # compare against the json serialization used before
+    baseline = json.dumps({
+        i: {"content": doc.page_content, "source": doc.metadata.get("source", "Unknown")}
+        for i, doc in enumerate(documents)
+    })
+    tokens_before, tokens_after = count_tokens(baseline), count_tokens(context)
+    with _stats_lock:
+        _stats['requests'] += 1
+        _stats['tokensBefore'] += tokens_before
+        _stats['tokensAfter'] += tokens_after
+    print(f"context tokens: {tokens_after} (saved {tokens_before - tokens_after})")
+    return context
+
+
+def stats() -> dict:
+    with _stats_lock:
+        return {**_stats, 'tokensSaved': _stats['tokensBefore'] - _stats['tokensAfter']}
+
+
+register_stats('context', stats)
@@ -1,12 +1,19 @@
 from langchain_community.chat_models import ChatOllama
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
 
 from __main__ import app
-from conversations.message import get_messages_by_conversation_id
-from users.user import get_user_by_id_controller
-from rag.rag import retrieve
+from conversations.conversation import get_conversation_by_id
+from conversations.summary import format_messages, get_conversation_history
+from users.user import authorize_user
+from rag.rag import retrieve, embed_query, lexical_probe
+from rag.answer_cache import answer_cache
+from llm.context import pack_context
 from users.user import User
+from utils.cache import LRUCache
+from utils.metrics import register_stats
 import json
+import re
+import time
 
 from langchain_core.documents import Document
 
@@ -116,30 +123,125 @@ Current Question: {question}
 Answer:
 """
 
-@app.route('/answer', methods=['POST'])
-def answer_user_prompt():
-    conversationId = request.json.get('conversationId')
-    userId = request.json.get('userId')
-    prompt = request.json.get('prompt')
-    if not conversationId or not userId or not prompt:
-        return jsonify({'error': 'ConversationId, userId, and prompt are required'}), 400
-    user = get_user_by_id_controller(userId)
-    if not user:
-        return jsonify({'error': 'User with id ' + userId + 'not found'}), 404
-    messages = get_messages_by_conversation_id(conversationId)
-    chat_history = [
-            f"{'Human' if message.isHuman else 'AI'}: {message.text}" for message in messages
-        ]
-    
-    if not chat_history:
-        chat_history_str = "No prior chat history available."
-    else:
-        chat_history_str = "\n".join(chat_history)  
+# used by the streaming endpoint, the answer is streamed as plain text and the sources are sent separately
+STREAMING_PROMPT = """
+You are an assistant for question-answering tasks. 
+{user_details}
+Use the following pieces of retrieved context to answer the question. 
+If you don't know the answer, just say that you don't know.
+If the answer is not in the context, DO NOT answer the question.
+
+Answer in plain text, do not list the sources.
+
+Question: {question} 
+
+Context: {context} 
+
+Answer:
+"""
+
+# words that usually refer back to the conversation
+REFERRING_WORDS = {
+    'it', 'its', 'this', 'that', 'these', 'those', 'they', 'them', 'their',
+    'he', 'him', 'his', 'she', 'her', 'hers', 'one', 'ones', 'former', 'latter',
+    'above', 'previous', 'earlier', 'again', 'also', 'else', 'more', 'same',
+    'first', 'second', 'third', 'last', 'next', 'other', 'another', 'there',
+}
+REFERRING_PREFIXES = ('and ', 'but ', 'so ', 'what about', 'how about', 'why not', 'then ')
+# words that carry no topic, a follow-up like "can you give me an example" is made only of them
+FUNCTION_WORDS = {
+    'a', 'an', 'the', 'of', 'in', 'on', 'at', 'to', 'for', 'from', 'with', 'by', 'about', 'as', 'into',
+    'and', 'or', 'but', 'if', 'so', 'than', 'then', 'not', 'no', 'yes', 'please', 'thanks',
+    'what', "what's", 'which', 'who', 'whom', 'whose', 'when', 'where', 'why', 'how', "how's",
+    'is', 'are', 'was', 'were', 'be', 'been', 'being', 'do', 'does', 'did', 'done', 'have', 'has', 'had',
+    'can', 'could', 'would', 'should', 'will', 'shall', 'may', 'might', 'must',
+    'i', 'me', 'my', 'we', 'us', 'our', 'you', 'your', "i'm", "don't", "doesn't", "isn't",
+    'some', 'any', 'all', 'each', 'every', 'very', 'just', 'only', 'really', 'much', 'many', 'exactly',
+    'tell', 'give', 'show', 'explain', 'describe', 'elaborate', 'summarize', 'summarise', 'clarify',
+    'expand', 'continue', 'go', 'mean', 'means', 'meaning', 'example', 'examples', 'detail', 'details',
+    'step', 'steps', 'part', 'point', 'proof', 'answer', 'question', 'further', 'simpler',
+    'simply', 'better', 'work', 'works', 'use', 'used', 'need', 'want', 'know', 'understand', 'sure',
+}
+# a question with history is only taken as standalone when it names at least this many topic words
+STANDALONE_MIN_CONTENT_WORDS = 3
+
+reformulation_cache = LRUCache(max_entries=4096)
+reformulation_stats = {
+    'calls': 0,
+    'skippedNoHistory': 0,
+    'skippedStandalone': 0,
+    'cacheHits': 0,
+}
+register_stats('reformulation', lambda: {
+    **reformulation_stats,
+    'avoided': reformulation_stats['skippedNoHistory'] + reformulation_stats['skippedStandalone'] + reformulation_stats['cacheHits'],
+    'cache': reformulation_cache.stats(),
+})
+
+def is_standalone(prompt: str) -> bool:
+    """
+    Tells whether a follow-up question is clearly self-contained. Short or elliptical
+    questions ("why?", "give me an example", "what's the time complexity") depend on
+    the conversation, so only questions naming enough topic words of their own, and
+    nothing that refers back, skip the reformulation.
+    """
+    lowered = prompt.strip().lower()
+    if lowered.startswith(REFERRING_PREFIXES):
+        return False
+    words = re.findall(r"[a-z0-9']+", lowered)
+    if REFERRING_WORDS.intersection(words):
+        return False
+    content_words = {word for word in words if word not in FUNCTION_WORDS}
+    return len(content_words) >= STANDALONE_MIN_CONTENT_WORDS
+
+def prepare_contextualization(conversationId, prompt: str):
+    """
+    Decides whether the prompt has to be reformulated with the conversation history.
+
+    Returns:
+        tuple[str, tuple, str]: The question to use when no LLM call is needed (None otherwise),
+        the reformulation cache key and the reformulation prompt
+    """
+    summary, messages = get_conversation_history(conversationId)
+    if not messages:
+        reformulation_stats['skippedNoHistory'] += 1
+        return prompt, None, None
+    if is_standalone(prompt):
+        reformulation_stats['skippedStandalone'] += 1
+        return prompt, None, None
+
+    cache_key = (conversationId, messages[-1].id, prompt)
+    cached = reformulation_cache.get(cache_key)
+    if cached is not None:
+        reformulation_stats['cacheHits'] += 1
+        return cached, None, None
+
+    chat_history_str = format_messages(messages)
+    if summary:
+        chat_history_str = f"Summary of the earlier conversation: {summary}\n{chat_history_str}"
 
     context_prompt = BASE_PROMPT_WITH_CHAT_HISTORY.format(
         chat_history=chat_history_str,
         question=prompt
     )
+    reformulation_stats['calls'] += 1
+    return None, cache_key, context_prompt
+
+def finish_contextualization(cache_key, prompt: str, response: str) -> str:
+    contextualized_prompt = response.strip().strip('"') or prompt
+    reformulation_cache.set(cache_key, contextualized_prompt)
+    return contextualized_prompt
+
+def contextualize_prompt(conversationId, prompt: str) -> str:
+    """
+    Reformulates the prompt into a standalone question using the conversation history.
+    The LLM is only called when there is history and the prompt seems to refer to it,
+    reformulations are cached per (conversation, last message, question).
+    The history is the rolling summary of the conversation plus its recent messages.
+    """
+    contextualized_prompt, cache_key, context_prompt = prepare_contextualization(conversationId, prompt)
+    if contextualized_prompt is not None:
+        return contextualized_prompt
 
     llm = ChatOllama(
         model="llama3.2",
@@ -147,16 +249,85 @@ def answer_user_prompt():
     )
     response = llm.invoke(context_prompt)
     # print("reformulated answer", response.content)
-    contextualized_prompt = response.content
+    return finish_contextualization(cache_key, prompt, response.content)
+
+def authorize_question(userId, conversationId, headers=None):
+    """
+    Returns the user asking a question in a conversation, None if the user or the
+    conversation does not exist. The conversation history is read into the prompt,
+    so the conversation must belong to the user.
+
+    Raises:
+        PermissionError: If the session token is not the user's or the conversation belongs to another user
+    """
+    user = authorize_user(userId, headers)
+    if not user:
+        return None
+    conversation = get_conversation_by_id(conversationId)
+    if not conversation:
+        return None
+    if conversation.userId != user.id:
+        raise PermissionError('Conversation belongs to another user')
+    return user
+
+@app.route('/answer', methods=['POST'])
+def answer_user_prompt():
+    conversationId = request.json.get('conversationId')
+    userId = request.json.get('userId')
+    prompt = request.json.get('prompt')
+    if not conversationId or not userId or not prompt:
+        return jsonify({'error': 'ConversationId, userId, and prompt are required'}), 400
+    try:
+        user = authorize_question(userId, conversationId)
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    if not user:
+        return jsonify({'error': f'User with id {userId} or conversation with id {conversationId} not found'}), 404
+    contextualized_prompt = contextualize_prompt(conversationId, prompt)
+
+    cached_answer, documents, query_embedding, corpus_version = prepare_answer(user.id, contextualized_prompt)
+    if cached_answer is not None:
+        return jsonify({
+            "answer": cached_answer
+            })
     
-    documents = retrieve(user.id, contextualized_prompt)
+    answer = summarize_rag(user, contextualized_prompt, documents)
+    answer_cache.set(user.id, query_embedding, answer, version=corpus_version, query=contextualized_prompt)
 
     return jsonify({
-        "answer": summarize_rag(user, contextualized_prompt, documents)
+        "answer": answer
         })
 
 
-def summarize_rag(user: User, query: str, documents: list[Document]):
+def prepare_answer(userId, query: str):
+    """
+    Looks a question up in the answer cache and retrieves its documents on a miss.
+    The same question is found by its text, near-identical ones by their embedding.
+    The query is only embedded when the lexical match is not decisive, the embedding
+    then serves both the cache lookup and the vector search.
+
+    Returns:
+        tuple: The cached answer (None on a miss), the documents, the query embedding
+        (None when it was not needed) and the corpus version read before retrieval
+    """
+    corpus_version = answer_cache.corpus_version(userId)
+    cached_answer = answer_cache.get_exact(userId, query)
+    if cached_answer is not None:
+        return cached_answer, [], None, corpus_version
+
+    lexical_results, decisive = lexical_probe(userId, query)
+    query_embedding = None
+    if not decisive:
+        query_embedding = embed_query(query)
+        cached_answer = answer_cache.get(userId, query_embedding)
+        if cached_answer is not None:
+            return cached_answer, [], query_embedding, corpus_version
+
+    documents = retrieve(userId, query, query_embedding, lexical_results=lexical_results)
+    return None, documents, query_embedding, corpus_version
+
+
+def build_answer_prompt(user: User, query: str, documents: list[Document]) -> str:
     if user.username and user.school and user.major:
         prompt = BASE_PROMPT_WITH_NAME_AND_SCHOOL_AND_MAJOR
     elif user.username and user.school:
@@ -166,10 +337,10 @@ def summarize_rag(user: User, query: str, documents: list[Document]):
     else:
         prompt = BASE_PROMPT
 
-    documents_str = json.dumps(listify_documents(documents))
+    documents_str = pack_context(documents)
 
     # Provide default values for missing fields
-    formatted_prompt = prompt.format(
+    return prompt.format(
         question=query,
         context=documents_str,
         user_name=user.username or "User",
@@ -177,11 +348,8 @@ def summarize_rag(user: User, query: str, documents: list[Document]):
         user_major=user.major or "Undeclared Major",
     )
 
-    llm = ChatOllama(
-        model="llama3.2",
-        temperature=0,
-    )
-    received_result = llm.invoke(formatted_prompt).content
+
+def parse_answer(received_result: str) -> str:
     try:
         result = json.loads(received_result)
         parsed_sources = [
@@ -194,6 +362,97 @@ def summarize_rag(user: User, query: str, documents: list[Document]):
     return json.dumps(result) if isinstance(result, dict) else result
 
 
+def summarize_rag(user: User, query: str, documents: list[Document]):
+    formatted_prompt = build_answer_prompt(user, query, documents)
+
+    llm = ChatOllama(
+        model="llama3.2",
+        temperature=0,
+    )
+    received_result = llm.invoke(formatted_prompt).content
+    return parse_answer(received_result)
+
+
+def parse_source(source: str) -> str:
+    return source.split("data", 1)[1] if "data" in source else source
+
+
+def build_streaming_prompt(user: User, query: str, documents: list[Document]) -> str:
+    user_details = []
+    if user.username:
+        user_details.append(f"You are assisting {user.username}, talk to them with this name.")
+    if user.username and user.school:
+        user_details.append(f"{user.username} is a student at {user.school}.")
+    if user.username and user.school and user.major:
+        user_details.append(f"They are majoring in {user.major}, take this into consideration.")
+    return STREAMING_PROMPT.format(
+        user_details="\n".join(user_details),
+        question=query,
+        context=pack_context(documents),
+    )
+
+
+def sources_of(documents: list[Document]) -> list[str]:
+    return list(dict.fromkeys(
+        parse_source(doc.metadata.get("source", "Unknown")) for doc in documents
+    ))
+
+
+def sse_event(data, event: str = None) -> str:
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+@app.route('/answer/stream', methods=['POST'])
+def stream_user_prompt():
+    """
+    Streaming variant of /answer, sends the answer as Server-Sent Events.
+    Each token is sent as a `token` event, followed by a `sources` event and a `done` event.
+    """
+    start = time.perf_counter()
+    conversationId = request.json.get('conversationId')
+    userId = request.json.get('userId')
+    prompt = request.json.get('prompt')
+    if not conversationId or not userId or not prompt:
+        return jsonify({'error': 'ConversationId, userId, and prompt are required'}), 400
+    try:
+        user = authorize_question(userId, conversationId)
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    if not user:
+        return jsonify({'error': f'User with id {userId} or conversation with id {conversationId} not found'}), 404
+
+    def generate():
+        try:
+            contextualized_prompt = contextualize_prompt(conversationId, prompt)
+            documents = retrieve(user.id, contextualized_prompt)
+            formatted_prompt = build_streaming_prompt(user, contextualized_prompt, documents)
+
+            llm = ChatOllama(
+                model="llama3.2",
+                temperature=0,
+            )
+            first_token = True
+            for chunk in llm.stream(formatted_prompt):
+                if not chunk.content:
+                    continue
+                if first_token:
+                    first_token = False
+                    print(f"time to first token: {time.perf_counter() - start:.2f}s")
+                yield sse_event({'token': chunk.content}, 'token')
+
+            yield sse_event({'sources': sources_of(documents)}, 'sources')
+            yield sse_event({}, 'done')
+        except Exception as e:
+            yield sse_event({'error': 'An error occurred', 'details': str(e)}, 'error')
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 def listify_documents(documents:list[Document]):
     result = {}
     for i in range(len(documents)):
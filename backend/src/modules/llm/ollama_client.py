@@ -0,0 +1,110 @@
+import json
+import os
+
+import httpx
+
+from utils.metrics import register_stats
+
+CHAT_MODEL = "llama3.2"
+# connections kept open to Ollama and shared by every in-flight request
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+# generation can take minutes on a busy server, connecting should not
+REQUEST_TIMEOUT = httpx.Timeout(300.0, connect=10.0)
+
+
+def ollama_base_url() -> str:
+    host = os.environ.get('OLLAMA_HOST', 'localhost:11434')
+    return host if host.startswith(('http://', 'https://')) else f'http://{host}'
+
+
+class AsyncOllamaClient:
+    """
+    Calls the Ollama chat API over a single pooled httpx.AsyncClient, so that concurrent
+    requests reuse connections instead of opening one each.
+    The client is created on first use, inside the event loop that serves the requests.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self._client = None
+        self.requests = 0
+        self.in_flight = 0
+        self.errors = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=REQUEST_TIMEOUT,
+                limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS),
+            )
+        return self._client
+
+    def _body(self, prompt: str, model: str, temperature: float, stream: bool) -> dict:
+        # a single user message, like ChatOllama.invoke with a string
+        return {
+            'model': model,
+            'messages': [{'role': 'user', 'content': prompt}],
+            'options': {'temperature': temperature},
+            'stream': stream,
+        }
+
+    async def chat(self, prompt: str, model: str = CHAT_MODEL, temperature: float = 0) -> str:
+        """
+        Returns the whole answer of the model to a prompt.
+        """
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            response = await self.client.post('/api/chat', json=self._body(prompt, model, temperature, False))
+            response.raise_for_status()
+            return response.json()['message']['content']
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    async def stream_chat(self, prompt: str, model: str = CHAT_MODEL, temperature: float = 0):
+        """
+        Yields the answer of the model to a prompt as it is generated.
+        """
+        self.requests += 1
+        self.in_flight += 1
+        try:
+            async with self.client.stream('POST', '/api/chat', json=self._body(prompt, model, temperature, True)) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get('error'):
+                        raise RuntimeError(chunk['error'])
+                    content = chunk.get('message', {}).get('content')
+                    if content:
+                        yield content
+                    if chunk.get('done'):
+                        break
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'inFlight': self.in_flight,
+            'errors': self.errors,
+        }
+
+
+ollama_client = AsyncOllamaClient(ollama_base_url())
+register_stats('ollama', ollama_client.stats)
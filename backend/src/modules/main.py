@@ -1,6 +1,9 @@
-from flask import Flask
+import os
+from flask import Flask, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
+from utils.secret_key import load_secret_key
+from utils.storage import DEFAULT_PROFILE, apply_pragmas, engine_options
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
@@ -8,19 +11,66 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 # Configure SQLite database
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///lessnotes.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# signs the session tokens, shared by every worker and restart, see utils/secret_key.py
+app.config['SECRET_KEY'] = load_secret_key()
+# bcrypt work factor of new password hashes, see benchmarks/bcrypt_rounds.py
+app.config['BCRYPT_ROUNDS'] = int(os.environ.get('LESSNOTES_BCRYPT_ROUNDS', '12'))
+# 'asgi' serves the LLM endpoints asynchronously with uvicorn, 'wsgi' serves everything with the Flask server
+app.config['SERVER_MODE'] = os.environ.get('LESSNOTES_SERVER', 'wsgi')
+# see utils/storage.py for the available profiles
+app.config['STORAGE_PROFILE'] = os.environ.get('LESSNOTES_STORAGE_PROFILE', DEFAULT_PROFILE)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['STORAGE_PROFILE'])
+# queue ingestion as soon as files change on disk instead of waiting for /process/<id>
+app.config['WATCH_FILES'] = os.environ.get('LESSNOTES_WATCH_FILES', '0') == '1'
 
 global db
 db = SQLAlchemy(app)
+with app.app_context():
+    apply_pragmas(db.engine, app.config['STORAGE_PROFILE'])
 
 import users.user 
 import rag.rag
 import conversations.conversation
 import conversations.message
+import conversations.summary
 import llm.llm
+import jobs.job
+import uploads.upload
+
+from utils.metrics import collect_stats
+from utils.schema import upgrade_schema
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify(collect_stats()), 200
 
 # Initialize the database
 with app.app_context():
     db.create_all()
+    upgrade_schema(db)
+
+def start_background_workers():
+    with app.app_context():
+        recovered = jobs.job.recover_stale_jobs()
+        expired = uploads.upload.expire_uploads()
+    if recovered:
+        print(f"queued {recovered} abandoned job(s) again")
+    if expired:
+        print(f"removed {expired} expired upload(s)")
+    jobs.job.start_job_workers()
+    uploads.upload.start_upload_sweeper()
+    if app.config['WATCH_FILES']:
+        from ingestion.watcher import start_file_watcher
+        start_file_watcher()
 
 if __name__ == '__main__':
-    app.run(port=8000, debug=True)
\ No newline at end of file
+    if app.config['SERVER_MODE'] == 'asgi':
+        import uvicorn
+        from llm.asgi import create_asgi_app
+        start_background_workers()
+        uvicorn.run(create_asgi_app(), port=8000)
+    else:
+        # with the reloader the app is served from a child process, only start the job workers there
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            start_background_workers()
+        app.run(port=8000, debug=True)
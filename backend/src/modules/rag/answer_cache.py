@@ -0,0 +1,211 @@
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.cache import LRUCache
+from utils.metrics import register_stats
+
+VERSIONS_PATH = "./db/answer_cache.sqlite3"
+SIMILARITY_THRESHOLD = 0.95
+MAX_ENTRIES = 4096
+TTL_SECONDS = 24 * 60 * 60
+
+
+class SemanticAnswerCache:
+    """
+    Cache of generated answers keyed by user, corpus version and query embedding.
+
+    A lookup hits when a cached query of the same user, made against the same
+    version of their files, has a cosine similarity of at least `threshold` with
+    the new query. Entries expire after `ttl_seconds` and the least recently used
+    ones are evicted past `max_entries`.
+
+    Answers are also kept by the exact text of the query, which is looked up
+    without an embedding.
+
+    The answers live in the memory of each process, the corpus versions are kept
+    on disk so that every worker process stops serving answers of older files.
+    """
+
+    def __init__(
+        self,
+        threshold: float = SIMILARITY_THRESHOLD,
+        max_entries: int = MAX_ENTRIES,
+        ttl_seconds: float = TTL_SECONDS,
+        path: str = VERSIONS_PATH,
+    ):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._entries = OrderedDict()    # entry id -> (userId, version, vector, answer, expires at)
+        self._by_user = {}               # userId -> set of entry ids
+        self._connection = None
+        # (userId, version, query) -> answer, entries of older versions are never hit and age out
+        self._exact = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS corpus_versions ('
+                'user_id TEXT PRIMARY KEY, '
+                'version INTEGER NOT NULL)'
+            )
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _read_version(self, key: str) -> int:
+        row = self._connect().execute(
+            'SELECT version FROM corpus_versions WHERE user_id = ?', (key,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _bump_version(self, key: str) -> None:
+        connection = self._connect()
+        connection.execute(
+            'INSERT INTO corpus_versions (user_id, version) VALUES (?, 1) '
+            'ON CONFLICT (user_id) DO UPDATE SET version = version + 1',
+            (key,),
+        )
+        connection.commit()
+
+    def corpus_version(self, userId) -> int:
+        with self._lock:
+            return self._read_version(str(userId))
+
+    def bump_corpus_version(self, userId) -> None:
+        """
+        Marks the files of a user as changed, answers cached for them are dropped.
+        """
+        with self._lock:
+            key = str(userId)
+            self._bump_version(key)
+            self._drop_user(key)
+
+    def invalidate(self, userId=None) -> None:
+        """
+        Drops the cached answers of a user, or of every user when no id is given.
+        """
+        with self._lock:
+            if userId is None:
+                self._entries.clear()
+                self._by_user.clear()
+                self._exact.clear()
+            else:
+                key = str(userId)
+                # the exact answers are keyed by version, moving to the next one leaves them behind
+                self._bump_version(key)
+                self._drop_user(key)
+            self.invalidations += 1
+
+    def get_exact(self, userId, query: str):
+        """
+        Returns the cached answer of the same query, made against the current version of the files.
+        """
+        return self._exact.get((str(userId), self.corpus_version(userId), self._normalize_query(query)))
+
+    def get(self, userId, query_embedding: list[float]):
+        """
+        Returns the cached answer of the most similar earlier query, if any is similar enough.
+        """
+        vector = self._normalize(query_embedding)
+        key = str(userId)
+        now = time.monotonic()
+        with self._lock:
+            version = self._read_version(key)
+            best_id, best_similarity = None, self.threshold
+            for entry_id in list(self._by_user.get(key, ())):
+                _, entry_version, entry_vector, _, expires_at = self._entries[entry_id]
+                if expires_at < now or entry_version != version:
+                    self._remove(entry_id)
+                    continue
+                similarity = float(np.dot(vector, entry_vector))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            return self._entries[best_id][3]
+
+    def set(self, userId, query_embedding: list[float], answer, version: int = None, query: str = None) -> None:
+        """
+        Caches an answer. `version` is the corpus version the answer was generated
+        from, read before retrieval so that a concurrent re-ingest is not missed.
+        The answer is kept by embedding when one is given, and by text when the query is given.
+        """
+        key = str(userId)
+        with self._lock:
+            current_version = self._read_version(key)
+            if version is not None and version != current_version:
+                return
+            if query is not None:
+                self._exact.set((key, current_version, self._normalize_query(query)), answer)
+            if query_embedding is None:
+                return
+            vector = self._normalize(query_embedding)
+            entry_id = next(self._ids)
+            self._entries[entry_id] = (
+                key,
+                current_version,
+                vector,
+                answer,
+                time.monotonic() + self.ttl_seconds,
+            )
+            self._by_user.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'threshold': self.threshold,
+                'exact': self._exact.stats(),
+            }
+
+    def _normalize_query(self, query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def _normalize(self, embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, entry_id) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            self._by_user.get(entry[0], set()).discard(entry_id)
+
+    def _drop_user(self, key: str) -> None:
+        for entry_id in self._by_user.pop(key, set()):
+            self._entries.pop(entry_id, None)
+
+
+answer_cache = SemanticAnswerCache()
+register_stats('answerCache', answer_cache.stats)
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from utils.metrics import register_stats
+
+CACHE_PATH = "./db/embedding_cache.sqlite3"
+MAX_ENTRIES = 500_000
+# the size bound is checked once this many embeddings were stored since the last check
+EVICT_EVERY = 5_000
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    On-disk, content-addressed store of embeddings keyed by (model, sha256 of the text).
+
+    Entries are evicted least recently used first once more than `max_entries`
+    are stored, checked every `evict_every` stored embeddings.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = MAX_ENTRIES, evict_every: int = EVICT_EVERY):
+        self.path = path
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self._lock = threading.Lock()
+        self._connection = None
+        self._stored_since_check = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings ('
+                'model TEXT NOT NULL, '
+                'hash TEXT NOT NULL, '
+                'vector BLOB NOT NULL, '
+                'last_used REAL NOT NULL, '
+                'PRIMARY KEY (model, hash))'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def get_many(self, model: str, hashes: list[str]) -> dict:
+        """
+        Looks up the cached embeddings of the given text hashes.
+
+        Args:
+            model (str): The embedding model name
+            hashes (list[str]): The hashes of the texts to look up
+
+        Returns:
+            dict: The embeddings found, keyed by text hash
+        """
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        with self._lock:
+            connection = self._connect()
+            # stay below SQLite's default limit on bound parameters
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = connection.execute(
+                    f'SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})',
+                    [model, *batch],
+                ).fetchall()
+                for hash_, vector in rows:
+                    found[hash_] = array('f', vector).tolist()
+            if found:
+                now = time.time()
+                connection.executemany(
+                    'UPDATE embeddings SET last_used = ? WHERE model = ? AND hash = ?',
+                    [(now, model, hash_) for hash_ in found],
+                )
+                connection.commit()
+            self.hits += sum(1 for hash_ in hashes if hash_ in found)
+            self.misses += sum(1 for hash_ in hashes if hash_ not in found)
+        return found
+
+    def put_many(self, model: str, entries: dict) -> None:
+        """
+        Stores embeddings and evicts the least recently used entries over the size bound.
+
+        Args:
+            model (str): The embedding model name
+            entries (dict): The embeddings to store, keyed by text hash
+        """
+        if not entries:
+            return
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                'INSERT OR REPLACE INTO embeddings (model, hash, vector, last_used) VALUES (?, ?, ?, ?)',
+                [(model, hash_, array('f', vector).tobytes(), now) for hash_, vector in entries.items()],
+            )
+            self._stored_since_check += len(entries)
+            if self._stored_since_check >= self.evict_every:
+                self._stored_since_check = 0
+                self._evict(connection)
+            connection.commit()
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        count = connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow > 0:
+            connection.execute(
+                'DELETE FROM embeddings WHERE rowid IN '
+                '(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)',
+                (overflow,),
+            )
+            self.evictions += overflow
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'maxEntries': self.max_entries,
+                'evictEvery': self.evict_every,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends texts missing from the cache to the underlying model.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        hashes = [text_hash(text) for text in texts]
+        found = self.cache.get_many(self.model, hashes)
+
+        missing = {}
+        for hash_, text in zip(hashes, texts):
+            if hash_ not in found and hash_ not in missing:
+                missing[hash_] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model, computed)
+            found.update(computed)
+
+        return [found[hash_] for hash_ in hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings.embed_query(text)
+
+
+embedding_cache = EmbeddingCache()
+register_stats('embeddingCache', embedding_cache.stats)
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+
+from langchain_core.documents import Document
+
+INDEX_PATH = "./db/lexical.sqlite3"
+# rows looked up per statement when deleting by chunk id
+LOOKUP_BATCH_SIZE = 500
+
+_TERM_PATTERN = re.compile(r"\w+")
+_IDENTIFIER_PATTERN = re.compile(r"^[A-Za-z0-9_]+$")
+
+# words too common to tell chunks apart, left out of the query unless it has nothing else
+STOPWORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'been', 'but', 'by', 'can', 'could', 'did', 'do',
+    'does', 'for', 'from', 'had', 'has', 'have', 'how', 'i', 'if', 'in', 'into', 'is', 'it', 'its',
+    'me', 'my', 'no', 'not', 'of', 'on', 'or', 'our', 's', 'so', 'than', 'that', 'the', 'their',
+    'them', 'then', 'there', 'these', 'they', 'this', 'those', 'to', 'was', 'we', 'were', 'what',
+    'when', 'where', 'which', 'who', 'why', 'will', 'with', 'would', 'you', 'your',
+})
+
+
+def terms_of(text: str) -> list[str]:
+    """
+    Returns the distinct lowercase terms of a text, in order.
+    """
+    return list(dict.fromkeys(term.lower() for term in _TERM_PATTERN.findall(text)))
+
+
+def content_terms(query: str) -> list[str]:
+    """
+    Returns the terms of a query that are not stopwords.
+    """
+    return [term for term in terms_of(query) if term not in STOPWORDS]
+
+
+def to_match_query(query: str) -> str:
+    """
+    Turns free text into an FTS5 query matching any of its terms but stopwords, quoting
+    each term so that punctuation in the question is not read as query syntax.
+    """
+    terms = content_terms(query) or terms_of(query)
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def fts_table_of(collection: str) -> str:
+    """
+    Returns the name of the FTS5 table of a collection, each collection has its own
+    so that lookups and BM25 statistics only cover that collection.
+    """
+    if _IDENTIFIER_PATTERN.match(collection):
+        return f'fts_{collection}'
+    return f'fts_{hashlib.sha256(collection.encode()).hexdigest()[:32]}'
+
+
+class LexicalIndex:
+    """
+    SQLite FTS5 index over the chunks of every collection, ranked with BM25.
+    It mirrors the Chroma collections and uses the same chunk ids.
+
+    The chunks are stored once in the chunk table, indexed on (collection, chunk_id)
+    and (collection, source). Each collection has an external content FTS5 table over
+    it, keyed by the rowid of the chunk, so that deletes are rowid lookups.
+    """
+
+    def __init__(self, path: str = INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._fts_tables = set()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS chunk ('
+                'id INTEGER PRIMARY KEY, '
+                'collection TEXT NOT NULL, '
+                'chunk_id TEXT NOT NULL, '
+                'source TEXT, '
+                'metadata TEXT, '
+                'content TEXT NOT NULL)'
+            )
+            connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS ix_chunk_collection_chunk_id ON chunk (collection, chunk_id)')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_chunk_collection_source ON chunk (collection, source)')
+            self._fts_tables = {
+                name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'fts\\_%' ESCAPE '\\'")
+            }
+            self._connection = connection
+            connection.commit()
+        return self._connection
+
+    def _fts_table(self, connection: sqlite3.Connection, collection: str) -> str:
+        table = fts_table_of(collection)
+        if table not in self._fts_tables:
+            connection.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS "{table}" USING fts5('
+                f"content, content='chunk', content_rowid='id')"
+            )
+            self._fts_tables.add(table)
+        return table
+
+    def _insert(self, connection: sqlite3.Connection, collection: str, rows: list[tuple]) -> None:
+        """
+        Inserts (chunk_id, source, metadata, content) rows, replacing the rows with the same chunk ids.
+        """
+        self._delete_rows(connection, collection, self._rows_of_ids(connection, collection, [row[0] for row in rows]))
+        table = self._fts_table(connection, collection)
+        for chunk_id, source, metadata, content in rows:
+            rowid = connection.execute(
+                'INSERT INTO chunk (collection, chunk_id, source, metadata, content) VALUES (?, ?, ?, ?, ?)',
+                (collection, chunk_id, source, metadata, content),
+            ).lastrowid
+            connection.execute(f'INSERT INTO "{table}" (rowid, content) VALUES (?, ?)', (rowid, content))
+
+    def _rows_of_ids(self, connection: sqlite3.Connection, collection: str, ids: list[str]) -> list[tuple]:
+        rows = []
+        for start in range(0, len(ids), LOOKUP_BATCH_SIZE):
+            batch = ids[start:start + LOOKUP_BATCH_SIZE]
+            rows += connection.execute(
+                f'SELECT id, content FROM chunk WHERE collection = ? AND chunk_id IN ({", ".join("?" * len(batch))})',
+                (collection, *batch),
+            ).fetchall()
+        return rows
+
+    def _delete_rows(self, connection: sqlite3.Connection, collection: str, rows: list[tuple]) -> None:
+        # external content tables are told which (rowid, content) to remove from the index
+        if not rows:
+            return
+        table = self._fts_table(connection, collection)
+        connection.executemany(f'INSERT INTO "{table}" ("{table}", rowid, content) VALUES (\'delete\', ?, ?)', rows)
+        connection.executemany('DELETE FROM chunk WHERE id = ?', [(rowid,) for rowid, _ in rows])
+
+    def add(self, collection: str, ids: list[str], documents: list[Document]) -> None:
+        with self._lock:
+            connection = self._connect()
+            self._insert(connection, collection, [
+                (chunk_id, doc.metadata.get('source'), json.dumps(doc.metadata), doc.page_content)
+                for chunk_id, doc in zip(ids, documents)
+            ])
+            connection.commit()
+
+    def delete_ids(self, collection: str, ids: list[str]) -> None:
+        with self._lock:
+            connection = self._connect()
+            self._delete_rows(connection, collection, self._rows_of_ids(connection, collection, list(ids)))
+            connection.commit()
+
+    def delete_source(self, collection: str, source: str) -> None:
+        with self._lock:
+            connection = self._connect()
+            rows = connection.execute(
+                'SELECT id, content FROM chunk WHERE collection = ? AND source = ?', (collection, source)
+            ).fetchall()
+            self._delete_rows(connection, collection, rows)
+            connection.commit()
+
+    def search(self, collection: str, query: str, k: int = 8) -> list[tuple[str, Document, float]]:
+        """
+        Returns the best BM25 matches of a query in a collection.
+
+        Returns:
+            list[tuple[str, Document, float]]: The chunk id, document and score of each match,
+            best first, higher scores are better
+        """
+        match_query = to_match_query(query)
+        if not match_query:
+            return []
+        with self._lock:
+            connection = self._connect()
+            table = fts_table_of(collection)
+            if table not in self._fts_tables:
+                return []
+            rows = connection.execute(
+                f'SELECT chunk.chunk_id, chunk.content, chunk.metadata, bm25("{table}") AS rank '
+                f'FROM "{table}" JOIN chunk ON chunk.id = "{table}".rowid '
+                f'WHERE "{table}" MATCH ? ORDER BY rank LIMIT ?',
+                (match_query, k),
+            ).fetchall()
+        return [
+            (chunk_id, Document(page_content=content, metadata=json.loads(metadata)), -rank)
+            for chunk_id, content, metadata, rank in rows
+        ]
+
+
+lexical_index = LexicalIndex()
@@ -1,70 +1,69 @@
 import os
-from langchain_unstructured import UnstructuredLoader
+import uuid
 from langchain_community.document_loaders import DirectoryLoader
 from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings
 from langchain_community.vectorstores.utils import filter_complex_metadata
 
 from flask import request, jsonify
 
 from __main__ import app
 
-from files.file import File, create_file, get_files_by_user_id, updateProcces, delete_documents_by_id
-from .rag_helpers import delete_documents_by_source, vector_db
+from ingestion.chunking import ChunkingRun, chunk_documents, record_run
+from ingestion.ingest import embed_and_store
+from ingestion.parse import parse_files
+from jobs.job import JobProgress, enqueue_job, register_job_handler
+from files.file import File, get_files_by_user_id, reconcile_files, get_chunk_ids_by_file_ids, complete_processing
+from files.tree import invalidate_file_tree
+from users.user import authorize_user
+from utils.metrics import register_stats
+from .rag_helpers import delete_documents_by_source, delete_documents_by_ids, compute_chunk_ids, reciprocal_rank_fusion, vector_db
+from .registry import collection_name, vectorstore_registry
+from .answer_cache import answer_cache
+from .lexical_index import content_terms, lexical_index, terms_of
 
-def load(file_paths:list[str], loader:str='unstructured') -> list[Document]:
-    """
-    Function that uses the UnstructuredLoader to load the files a given directory
-
-    Args:
-        path (str): The path to the directory containing the files
-        loader (str): The loader to use
+RETRIEVAL_K = 4
+# a BM25 match this many times stronger than the next one skips the vector search. BM25 scores
+# grow with the size of the corpus, so the match is judged against the other matches of the query
+LEXICAL_DECISIVE_RATIO = float(os.environ.get('LESSNOTES_LEXICAL_DECISIVE_RATIO', '2.0'))
+# optional floor on the score of the best match, 0 disables it
+LEXICAL_MIN_SCORE = float(os.environ.get('LESSNOTES_LEXICAL_MIN_SCORE', '0'))
+# share of the query's non-stopword terms the best match must contain
+LEXICAL_MIN_TERM_COVERAGE = float(os.environ.get('LESSNOTES_LEXICAL_MIN_TERM_COVERAGE', '1.0'))
 
-    Returns:
-        list[Document]: A list of Document objects
-    """
-    if loader == 'unstructured':
-        loader = UnstructuredLoader(file_paths)
-    # elif loader == 'directory':
-    #     # does not work if .txt files are in subdirectories
-    #     loader = DirectoryLoader(path)
-    return loader.load()
+retrieval_stats = {
+    'lexicalOnly': 0,
+    'hybrid': 0,
+}
+register_stats('retrieval', lambda: dict(retrieval_stats))
 
-def split(documents: list[Document]) -> list[Document]:
+def split(documents: list[Document], run:ChunkingRun=None) -> list[Document]:
     """
-    Function that splits documents into chunks
+    Function that splits documents into chunks, using the chunking strategy of each file type
 
     Args:
         documents (list[Document]): A list of Document objects
+        run (ChunkingRun): Optional run receiving the chunk amplification metrics
 
     Returns:
         list[Document]: A list of split Document objects
     """
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1024,
-        chunk_overlap=1000,
-        length_function=len,
-        is_separator_regex=False,
-    )
-    return text_splitter.split_documents(documents)
+    return chunk_documents(documents, run)
 
-def ingest(documents: list[Document]) -> None:
+def ingest(documents: list[Document], userId:int, ids:list[str]=None, on_progress=None) -> dict:
     """
     Function that ingests the documents into a local ChromaDB instance.
+    Chunks are embedded in batches on a bounded worker pool and written as they finish.
 
     Args:
         documents (list[Document]): A list of Document objects.
+        userId (int): The id of the user owning the documents.
+        ids (list[str]): Optional ids of the documents, random ids are used otherwise.
+        on_progress (Callable[[int], None]): Optional callback receiving the number of chunks ingested so far.
+
+    Returns:
+        dict: The number of chunks ingested and the chunks per second
     """
-    embeddings = OllamaEmbeddings(
-        model="mxbai-embed-large",
-    )
-    vectorstore = Chroma(
-        collection_name="user1",
-        embedding_function=embeddings,
-        persist_directory="./db/chroma_db",
-    )
+    vectorstore = vector_db(userId)
 
     documents = filter_complex_metadata(documents)
     # Filter complex metadata
@@ -73,87 +72,225 @@ def ingest(documents: list[Document]) -> None:
     #     if hasattr(document, "metadata"):
     #         document.metadata = filter_complex_metadata(document.metadata)
     
-    # Add documents to vectorstore
-    vectorstore.add_documents(documents)
+    if ids is None:
+        ids = [str(uuid.uuid4()) for _ in documents]
+
+    # Add documents to vectorstore, and to the lexical index under the same ids
+    run = embed_and_store(vectorstore, vectorstore_registry.embeddings, documents, ids=ids, on_progress=on_progress)
+    lexical_index.add(collection_name(userId), ids, documents)
+    vectorstore_registry.touch(userId)
+    print(f"ingested {run['chunks']} chunks at {run['chunksPerSecond']:.1f} chunks/s")
+    return run
+
+def embed_query(query:str) -> list[float]:
+    """
+    Function that embeds a query with the shared embedding model
+    """
+    return vectorstore_registry.embeddings.embed_query(query)
 
-def retrieve(userId:int, query:str) -> list[Document]:
+def is_decisive(lexical_results:list, query:str) -> bool:
     """
-    Function that retrieves the documents from a local ChromaDB instance
+    Function that tells whether the best BM25 match is far enough ahead of the next
+    one, and covers enough of the query's terms, to answer from the lexical index alone.
+    A query made only of stopwords is never answered from the lexical index alone.
+    """
+    if not lexical_results or lexical_results[0][2] < LEXICAL_MIN_SCORE:
+        return False
+    query_terms = content_terms(query)
+    if not query_terms:
+        return False
+    best_terms = set(terms_of(lexical_results[0][1].page_content))
+    if sum(term in best_terms for term in query_terms) < LEXICAL_MIN_TERM_COVERAGE * len(query_terms):
+        return False
+    return len(lexical_results) == 1 or lexical_results[0][2] >= LEXICAL_DECISIVE_RATIO * lexical_results[1][2]
+
+def lexical_probe(userId:int, query:str, k:int=RETRIEVAL_K) -> tuple[list, bool]:
+    """
+    Function that runs the lexical search of a query, before deciding whether it has to be embedded
+
+    Returns:
+        tuple[list, bool]: The BM25 matches and whether they are decisive
+    """
+    lexical_results = lexical_index.search(collection_name(userId), query, k=k * 2)
+    return lexical_results, is_decisive(lexical_results, query)
+
+def retrieve(userId:int, query:str, query_embedding:list[float]=None, k:int=RETRIEVAL_K, lexical_results:list=None) -> list[Document]:
+    """
+    Function that retrieves the documents of a user by fusing lexical (BM25) and vector
+    search results with reciprocal rank fusion. When the lexical match is decisive
+    the vector search, and the query embedding, are skipped.
 
     Args:
+        userId (int): The id of the user whose documents are searched
         query (str): The query to use
+        query_embedding (list[float]): Optional embedding of the query, saves embedding it again
+        k (int): The number of documents to return
+        lexical_results (list): The results of lexical_probe, when it already ran
 
     Returns:
         list[Document]: A list of Document objects
     """
-    embeddings = OllamaEmbeddings(
-        model="mxbai-embed-large",
-    )
-    vectorstore = Chroma(
-        collection_name="user" + str(userId),
-        embedding_function=embeddings,
-        persist_directory="./db/chroma_db",  
+    if lexical_results is None:
+        lexical_results, _ = lexical_probe(userId, query, k)
+    if is_decisive(lexical_results, query):
+        retrieval_stats['lexicalOnly'] += 1
+        return [document for _, document, _ in lexical_results[:k]]
+
+    retrieval_stats['hybrid'] += 1
+    if query_embedding is None:
+        query_embedding = embed_query(query)
+    vectorstore = vector_db(userId)
+    vector_results = vectorstore._collection.query(
+        query_embeddings=[query_embedding],
+        n_results=k * 2,
+        include=['documents', 'metadatas'],
     )
-    return vectorstore.similarity_search(query)
+
+    documents_by_id = {chunk_id: document for chunk_id, document, _ in lexical_results}
+    for chunk_id, content, metadata in zip(
+        vector_results['ids'][0], vector_results['documents'][0], vector_results['metadatas'][0]
+    ):
+        documents_by_id.setdefault(chunk_id, Document(page_content=content, metadata=metadata or {}))
+
+    fused_ids = reciprocal_rank_fusion([
+        [chunk_id for chunk_id, _, _ in lexical_results],
+        vector_results['ids'][0],
+    ])
+    return [documents_by_id[chunk_id] for chunk_id in fused_ids[:k]]
 
 # Functions below just to see how it works
 def main():
-    documents = load(path='./files/1/data/', loader='unstructured')
+    paths = [os.path.join(root, name) for root, _, names in os.walk('./files/1/data/') for name in names]
+    documents = []
+    for result in parse_files(paths):
+        if result.error:
+            print(f"failed to parse {result.path}: {result.error}")
+        documents.extend(result.documents)
     documents = split(documents)
-    ingest(documents)
+    ingest(documents, 1)
     query = "why is the bohdi tree important"
     results = retrieve(1, query)
     print(results)
 
+def process_user_files(id, progress:JobProgress, paths:list[str]=None) -> dict:
+    """
+    Function that runs the walk -> hash -> load -> split -> ingest pipeline for a user's files.
+
+    Args:
+        id (int): The id of the user
+        progress (JobProgress): Receives the stage and counters of the pipeline
+        paths (list[str]): The changed paths reported by the file watcher, when None all files are scanned
+
+    Returns:
+        dict: The files that failed to parse and the number of chunks ingested
+    """
+    if paths is None:
+        base_path = os.path.normpath(os.path.join('./files', str(id), 'data'))
+
+        file_paths = set()
+        for root, dirs, files in os.walk(base_path):
+            for file in files:
+                file_paths.add(os.path.join(os.getcwd(), root, file))
+    else:
+        file_paths = set(paths)
+
+    vectorstore = vector_db(id)
+
+    # hash changed files and sync the file table in one transaction,
+    # files gone from disk are removed from the vector db first
+    progress.stage('hashing', filesTotal=len(file_paths), filesHashed=0)
+    files, deleted_files = reconcile_files(
+        id,
+        file_paths,
+        on_delete=lambda file: delete_documents_by_source(vectorstore, file['path']),
+        on_progress=lambda hashed: progress.update(filesHashed=hashed),
+        partial=paths is not None,
+    )
+    corpus_changed = bool(deleted_files)
+    if deleted_files or any(not file['processed'] for file in files):
+        # the tree may also have changed outside of an upload
+        invalidate_file_tree(id)
+
+    files_to_be_processed = [file for file in files if not file['processed']]
+    
+    # load -> split, each file is split as soon as it has been parsed
+    progress.stage('parsing', filesToParse=len(files_to_be_processed), filesParsed=0)
+    chunks_by_source = {}
+    failed_files = {}
+    chunking_run = ChunkingRun()
+    for parsed, result in enumerate(parse_files([file['path'] for file in files_to_be_processed]), start=1):
+        progress.update(filesParsed=parsed)
+        if result.error:
+            failed_files[result.path] = result.error
+            continue
+        chunks_by_source[result.path] = split(result.documents, chunking_run) if result.documents else []
+    record_run(chunking_run)
+
+    # files that failed to parse stay unprocessed and are retried on the next run
+    files_to_be_processed = [file for file in files_to_be_processed if file['path'] not in failed_files]
+
+    # only embed the chunks that are new, unchanged chunks keep their vectors
+    new_documents, new_ids, manifests = [], [], {}
+    previous_manifests = get_chunk_ids_by_file_ids([file['id'] for file in files_to_be_processed])
+    for file in files_to_be_processed:
+        chunks = chunks_by_source.get(file['path'], [])
+        chunk_ids = compute_chunk_ids(chunks)
+        previous_ids = previous_manifests[file['id']]
+        if not previous_ids:
+            # no manifest yet, drop anything ingested under random ids
+            delete_documents_by_source(vectorstore, file['path'])
+        removed_ids = previous_ids - set(chunk_ids)
+        delete_documents_by_ids(vectorstore, list(removed_ids))
+        corpus_changed = corpus_changed or bool(removed_ids) or not previous_ids
+        for chunk, chunk_id in zip(chunks, chunk_ids):
+            if chunk_id not in previous_ids:
+                new_documents.append(chunk)
+                new_ids.append(chunk_id)
+        manifests[file['id']] = chunk_ids
+
+    # ingest
+    progress.stage('embedding', chunksToEmbed=len(new_documents), chunksEmbedded=0)
+    if new_documents:
+        ingest(new_documents, id, ids=new_ids, on_progress=lambda embedded: progress.update(chunksEmbedded=embedded))
+
+    complete_processing(manifests)
+
+    # answers cached for the previous version of the files are stale now
+    if corpus_changed or new_documents:
+        answer_cache.bump_corpus_version(id)
+
+    return {'failed': failed_files, 'chunksIngested': len(new_documents), 'chunking': chunking_run.to_dict()}
+
+register_job_handler(process_user_files)
+
 @app.route('/process/<int:id>', methods=['POST'])
 def process(id):
+    """
+    Queues the processing of a user's files and returns the job right away.
+    Progress is reported by GET /jobs/<jobId>.
+    """
     print("processing documents")
     try:
         if id is None:
             return jsonify({'error': 'Id is required'}), 400
-        
-        base_path = os.path.normpath(os.path.join('./files', str(id), 'data'))
+        if not authorize_user(id):
+            return jsonify({'error': f'User with id {id} not found'}), 404
 
-        file_paths = set()
-        for root, dirs, files in os.walk(base_path):
-            for file in files:
-                file_paths.add(os.path.join(os.getcwd(), root, file))
+        job = enqueue_job(id)
 
-        for file in file_paths:
-            create_file(file, id)
-
-        files = get_files_by_user_id(id)
-
-        vectorstore = vector_db(id)
-
-        files_to_be_processed = []
-        
-        for file in files:
-            if file['path'] not in file_paths:
-                delete_documents_by_source(vectorstore, file['path'])   # delete from vector db
-                delete_documents_by_id(file['id'])                      # delete from table
-            if not file['processed']:
-                files_to_be_processed.append(file)
-                delete_documents_by_source(vectorstore, file['path'])
-        
-        # load -> split -> ingest
-        documents = load([file['path'] for file in files_to_be_processed], loader='unstructured')
-        if documents:
-            documents = split(documents)
-        if documents:
-            ingest(documents)
-
-        for file in files_to_be_processed:
-            updateProcces(file['id'])
-
-        return jsonify({'message': 'files processed'}), 200
+        return jsonify({'message': 'processing queued', 'job': job.to_dict()}), 202
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
     except Exception as e:
         return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
     
 @app.route('/files/<int:userId>', methods=['GET'])
 def get_files(userId):
     try:
+        authorize_user(userId)
         return jsonify(get_files_by_user_id(userId))
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
     except Exception as e:
         return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
    
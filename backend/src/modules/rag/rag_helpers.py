@@ -1,22 +1,18 @@
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
 from typing import Optional
+import hashlib
 import os
 
-from langchain_ollama import OllamaEmbeddings
 import time
 from langchain_community.vectorstores.utils import filter_complex_metadata
 from langchain_unstructured import UnstructuredLoader
 
+from rag.registry import vectorstore_registry
+from rag.lexical_index import lexical_index
+
 def vector_db(id):
-    embeddings = OllamaEmbeddings(
-        model="mxbai-embed-large",
-    )
-    vectorstore = Chroma(
-        collection_name=f"user{id}",
-        embedding_function=embeddings,
-        persist_directory="./db/chroma_db",  
-    )
-    return vectorstore
+    return vectorstore_registry.get(id)
 
 def delete_documents_by_source(
     vector_store: Chroma,
@@ -33,6 +29,7 @@ def delete_documents_by_source(
     """
     # Get all documents with their metadata
     collection = vector_store._collection
+    lexical_index.delete_source(collection.name, source_path)
     
     # Get all document IDs and their metadata
     docs = collection.get(
@@ -53,6 +50,52 @@ def delete_documents_by_source(
         collection.delete(ids_to_delete)
 
 
+def delete_documents_by_ids(vector_store: Chroma, ids: list[str]) -> None:
+    """
+    Delete the documents with the given ids from a Chroma vector store.
+    """
+    if ids:
+        vector_store._collection.delete(ids=list(ids))
+        lexical_index.delete_ids(vector_store._collection.name, list(ids))
+
+def compute_chunk_ids(documents: list[Document]) -> list[str]:
+    """
+    Derive deterministic ids for chunks from their source and content hash.
+    Identical chunks within the same source are told apart by their occurrence.
+
+    Args:
+        documents (list[Document]): The chunks, in document order
+
+    Returns:
+        list[str]: The id of each chunk
+    """
+    ids = []
+    occurrences = {}
+    for document in documents:
+        source = document.metadata.get('source', '')
+        content_hash = hashlib.sha256(document.page_content.encode('utf-8')).hexdigest()
+        occurrence = occurrences.get((source, content_hash), 0)
+        occurrences[(source, content_hash)] = occurrence + 1
+        ids.append(hashlib.sha256(f"{source}\0{content_hash}\0{occurrence}".encode('utf-8')).hexdigest())
+    return ids
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[str]:
+    """
+    Merge several rankings of ids into one, scoring each id by the sum of 1 / (k + rank).
+
+    Args:
+        rankings (list[list[str]]): The rankings to merge, best first
+        k (int): Damps the weight of the top ranks
+
+    Returns:
+        list[str]: The ids ordered by fused score
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, start=1):
+            scores[id] = scores.get(id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
     
 if __name__ == '__main__':
     # Add a file to the vector database
@@ -0,0 +1,164 @@
+import threading
+from collections import OrderedDict
+
+import chromadb
+from chromadb.config import Settings
+from langchain_chroma import Chroma
+from langchain_ollama import OllamaEmbeddings
+
+from utils.metrics import register_stats
+from .embedding_cache import CachedEmbeddings, embedding_cache
+
+EMBEDDING_MODEL = "mxbai-embed-large"
+EMBEDDING_DIMENSION = 1024
+PERSIST_DIRECTORY = "./db/chroma_db"
+
+# Upper bounds on what stays loaded, the least recently used users are unloaded first
+MAX_COLLECTIONS = 64
+MEMORY_LIMIT_BYTES = 2 * 1024 ** 3
+
+
+def collection_name(userId) -> str:
+    return f"user{userId}"
+
+
+class VectorStoreRegistry:
+    """
+    Process-wide registry handing out one shared embeddings client and a cached
+    Chroma handle per user.
+
+    Handles are kept in LRU order. When more than `max_collections` handles are
+    open, or their estimated index size exceeds `memory_limit_bytes`, the least
+    recently used ones are dropped. The same memory limit is given to Chroma's
+    segment cache so that the HNSW indexes of idle users are unloaded as well.
+    """
+
+    def __init__(
+        self,
+        persist_directory: str = PERSIST_DIRECTORY,
+        embedding_model: str = EMBEDDING_MODEL,
+        max_collections: int = MAX_COLLECTIONS,
+        memory_limit_bytes: int = MEMORY_LIMIT_BYTES,
+    ):
+        self.persist_directory = persist_directory
+        self.embedding_model = embedding_model
+        self.max_collections = max_collections
+        self.memory_limit_bytes = memory_limit_bytes
+
+        self._lock = threading.RLock()
+        self._client = None
+        self._embeddings = None
+        self._stores = OrderedDict()    # userId -> (Chroma, estimated bytes)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def embeddings(self) -> CachedEmbeddings:
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = CachedEmbeddings(
+                    OllamaEmbeddings(model=self.embedding_model),
+                    model=self.embedding_model,
+                    cache=embedding_cache,
+                )
+            return self._embeddings
+
+    @property
+    def client(self) -> chromadb.ClientAPI:
+        with self._lock:
+            if self._client is None:
+                self._client = chromadb.PersistentClient(
+                    path=self.persist_directory,
+                    settings=Settings(
+                        anonymized_telemetry=False,
+                        chroma_segment_cache_policy="LRU",
+                        chroma_memory_limit_bytes=self.memory_limit_bytes,
+                    ),
+                )
+            return self._client
+
+    def get(self, userId) -> Chroma:
+        """
+        Returns the vector store of a user, opening it on first use.
+
+        Args:
+            userId (int): The id of the user owning the collection
+
+        Returns:
+            Chroma: The cached vector store of the user
+        """
+        key = str(userId)
+        with self._lock:
+            entry = self._stores.get(key)
+            if entry is not None:
+                self._stores.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            self.misses += 1
+            vectorstore = Chroma(
+                client=self.client,
+                collection_name=collection_name(userId),
+                embedding_function=self.embeddings,
+            )
+            self._stores[key] = (vectorstore, self._estimate_bytes(vectorstore))
+            self._evict_if_needed()
+            return vectorstore
+
+    def touch(self, userId) -> None:
+        """
+        Refreshes the size estimate of a user's collection after it was written to.
+        """
+        key = str(userId)
+        with self._lock:
+            entry = self._stores.get(key)
+            if entry is not None:
+                self._stores[key] = (entry[0], self._estimate_bytes(entry[0]))
+                self._evict_if_needed(keep=key)
+
+    def evict(self, userId) -> None:
+        with self._lock:
+            if self._stores.pop(str(userId), None) is not None:
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'openCollections': len(self._stores),
+                'estimatedBytes': self._total_bytes(),
+                'memoryLimitBytes': self.memory_limit_bytes,
+            }
+
+    def _estimate_bytes(self, vectorstore: Chroma) -> int:
+        try:
+            count = vectorstore._collection.count()
+        except Exception:
+            count = 0
+        # float32 vectors plus roughly the same again for the HNSW graph links
+        return count * EMBEDDING_DIMENSION * 4 * 2
+
+    def _total_bytes(self) -> int:
+        return sum(size for _, size in self._stores.values())
+
+    def _evict_if_needed(self, keep=None) -> None:
+        while len(self._stores) > 1 and (
+            len(self._stores) > self.max_collections
+            or self._total_bytes() > self.memory_limit_bytes
+        ):
+            oldest = next(iter(self._stores))
+            if oldest == keep:
+                self._stores.move_to_end(oldest)
+                oldest = next(iter(self._stores))
+            del self._stores[oldest]
+            self.evictions += 1
+
+
+vectorstore_registry = VectorStoreRegistry()
+register_stats('vectorstores', vectorstore_registry.stats)
@@ -0,0 +1,333 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from flask import jsonify, request
+
+from __main__ import app, db
+from files.tree import invalidate_file_tree
+from users.user import authorize_user
+from utils.create_directory_structure import resolve_upload_path, staging_path_of
+from utils.hash import compute_hash
+
+# parts are at most this large, the body of a part is streamed to disk in reads of READ_SIZE
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+MAX_PART_SIZE = 64 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+# uploads not touched for this long, finished or not, are removed by expire_uploads
+UPLOAD_EXPIRY = timedelta(days=1)
+SWEEP_INTERVAL_SECONDS = 60 * 60
+
+# one request at a time writes the parts of an upload, an entry only lives while requests use it
+_upload_locks = {}      # upload id -> [lock, requests holding or waiting for it]
+_upload_locks_guard = threading.Lock()
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+class Upload(db.Model):
+    id = db.Column(db.String(36), primary_key=True)
+    userId = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    path = db.Column(db.String(1000), nullable=False)           # relative to the user's data folder
+    size = db.Column(db.BigInteger, nullable=False)
+    partSize = db.Column(db.Integer, nullable=False)
+    hash = db.Column(db.String(64), nullable=True)               # sha256 of the whole file, checked on completion
+    received = db.Column(db.BigInteger, nullable=False, default=0)
+    status = db.Column(db.String(20), nullable=False, default='uploading')   # uploading, done
+    createdAt = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+    updatedAt = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'userId': self.userId,
+            'path': self.path,
+            'size': self.size,
+            'partSize': self.partSize,
+            'offset': self.received,
+            'status': self.status,
+            'createdAt': self.createdAt.isoformat() if self.createdAt else None,
+            'updatedAt': self.updatedAt.isoformat() if self.updatedAt else None
+        }
+
+
+@contextmanager
+def upload_lock(upload_id: str):
+    """
+    Holds the lock of an upload. The lock is dropped once no request holds or waits for it,
+    so finished, aborted and abandoned uploads leave nothing behind.
+    """
+    with _upload_locks_guard:
+        entry = _upload_locks.setdefault(upload_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _upload_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _upload_locks[upload_id]
+
+
+def data_folder_of(user_id) -> str:
+    return os.path.join(app.config['UPLOAD_FOLDER'], str(user_id), 'data')
+
+
+def temp_path_of(upload: Upload) -> str:
+    """
+    Returns the path of the file the parts of an upload are written to. It sits in the
+    staging folder next to the user's data folder so that partial files are never ingested.
+    """
+    return os.path.join(staging_path_of(data_folder_of(upload.userId)), f'{upload.id}.part')
+
+
+def data_path_of(upload: Upload) -> str:
+    return resolve_upload_path(data_folder_of(upload.userId), upload.path)
+
+
+def expire_uploads():
+    """
+    Removes the uploads not touched for UPLOAD_EXPIRY: abandoned ones along with their
+    partial files, and finished ones, which are only kept to answer a repeated complete.
+    Files left in the staging folders for as long, by a crash or a removed row, go too.
+
+    Returns:
+        int: The number of uploads removed
+    """
+    cutoff = datetime.now() - UPLOAD_EXPIRY
+    try:
+        expired = Upload.query.filter(Upload.updatedAt < cutoff).all()
+        for upload in expired:
+            if upload.status == 'uploading' and os.path.exists(temp_path_of(upload)):
+                os.unlink(temp_path_of(upload))
+            db.session.delete(upload)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise RuntimeError(f"An unexpected error occurred: {e}")
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+    for user_folder in os.listdir(upload_folder) if os.path.isdir(upload_folder) else []:
+        staging_path = staging_path_of(data_folder_of(user_folder))
+        if not os.path.isdir(staging_path):
+            continue
+        for entry in os.scandir(staging_path):
+            if entry.is_file() and entry.stat().st_mtime < cutoff.timestamp():
+                os.unlink(entry.path)
+    return len(expired)
+
+
+def start_upload_sweeper():
+    """
+    Starts the thread removing expired uploads every SWEEP_INTERVAL_SECONDS, once per process.
+    """
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper:
+            return
+        _sweeper = threading.Thread(target=_sweep_uploads, name='upload-sweeper', daemon=True)
+        _sweeper.start()
+
+
+def _sweep_uploads():
+    while True:
+        time.sleep(SWEEP_INTERVAL_SECONDS)
+        try:
+            with app.app_context():
+                expire_uploads()
+        except Exception as e:
+            print(f"upload sweep error: {e}")
+
+
+def write_part(upload: Upload, offset: int, stream, length: int, checksum: str = None) -> None:
+    """
+    Streams a part of an upload into its partial file at the given offset.
+    When the checksum does not match, the partial file is truncated back to the offset.
+
+    Args:
+        upload (Upload): The upload the part belongs to
+        offset (int): The offset of the part in the file, must be the offset acknowledged so far
+        stream: The body of the request
+        length (int): The size of the part in bytes
+        checksum (str): The sha256 of the part
+
+    Raises:
+        ValueError: If the part is too large, shorter than announced or does not match its checksum
+    """
+    if length > upload.partSize or offset + length > upload.size:
+        raise ValueError('Part is larger than the part size or the end of the file')
+
+    digest = hashlib.sha256()
+    with open(temp_path_of(upload), 'r+b') as temp_file:
+        temp_file.seek(offset)
+        remaining = length
+        while remaining:
+            data = stream.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            temp_file.write(data)
+            digest.update(data)
+            remaining -= len(data)
+        if remaining or (checksum and digest.hexdigest() != checksum.lower()):
+            temp_file.truncate(offset)
+            raise ValueError('Part is incomplete or does not match its checksum')
+
+
+@app.route('/users/<int:user_id>/uploads', methods=['POST'])
+def create_upload(user_id):
+    """
+    Starts a resumable upload of a file into the user's data folder.
+    The body gives the path of the file, its size, and optionally its sha256 and the part size.
+    """
+    try:
+        user = authorize_user(user_id)
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+
+        data = request.get_json(silent=True) or {}
+        size = data.get('size')
+        part_size = data.get('partSize', DEFAULT_PART_SIZE)
+        if not isinstance(size, int) or size < 0:
+            return jsonify({'error': 'size must be a non-negative integer'}), 400
+        if not isinstance(part_size, int) or not 0 < part_size <= MAX_PART_SIZE:
+            return jsonify({'error': f'partSize must be between 1 and {MAX_PART_SIZE}'}), 400
+
+        upload = Upload(
+            id=str(uuid.uuid4()),
+            userId=user_id,
+            path=data.get('path'),
+            size=size,
+            partSize=part_size,
+            hash=data.get('hash'),
+            received=0,
+            status='uploading',
+            createdAt=datetime.now(),
+            updatedAt=datetime.now()
+        )
+        data_path_of(upload)    # rejects paths outside the data folder
+
+        os.makedirs(os.path.dirname(temp_path_of(upload)), exist_ok=True)
+        open(temp_path_of(upload), 'wb').close()
+        db.session.add(upload)
+        db.session.commit()
+        return jsonify(upload.to_dict()), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
+
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """
+    Returns an upload, its offset is where the client resumes.
+    """
+    try:
+        upload = Upload.query.get(upload_id)
+        if not upload:
+            return jsonify({'error': f'Upload with ID {upload_id} not found'}), 404
+        authorize_user(upload.userId)
+        return jsonify(upload.to_dict()), 200
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except Exception as e:
+        return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
+
+
+@app.route('/uploads/<upload_id>/parts', methods=['PUT'])
+def upload_part(upload_id):
+    """
+    Receives the raw bytes of a part. The offset query argument must match the offset
+    acknowledged so far, otherwise 409 is returned with the upload to resume from.
+    The X-Checksum-Sha256 header is checked against the bytes received.
+    """
+    with upload_lock(upload_id):
+        try:
+            upload = Upload.query.get(upload_id)
+            if not upload:
+                return jsonify({'error': f'Upload with ID {upload_id} not found'}), 404
+            authorize_user(upload.userId)
+            if upload.status != 'uploading':
+                return jsonify({'error': 'Upload is already complete', 'upload': upload.to_dict()}), 409
+
+            offset = request.args.get('offset', type=int)
+            if offset != upload.received:
+                return jsonify({'error': 'Offset does not match the upload', 'upload': upload.to_dict()}), 409
+            if request.content_length is None:
+                return jsonify({'error': 'Content-Length is required'}), 411
+
+            write_part(upload, offset, request.stream, request.content_length, request.headers.get('X-Checksum-Sha256'))
+            upload.received = offset + request.content_length
+            upload.updatedAt = datetime.now()
+            db.session.commit()
+            return jsonify(upload.to_dict()), 200
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except PermissionError as e:
+            return jsonify({'error': str(e)}), 403
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
+
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """
+    Checks the received file against its sha256 and moves it into the user's data
+    folder in one rename, so the file appears there whole or not at all.
+    """
+    with upload_lock(upload_id):
+        try:
+            upload = Upload.query.get(upload_id)
+            if not upload:
+                return jsonify({'error': f'Upload with ID {upload_id} not found'}), 404
+            authorize_user(upload.userId)
+            if upload.status != 'uploading':
+                return jsonify(upload.to_dict()), 200
+            if upload.received != upload.size:
+                return jsonify({'error': 'Upload is incomplete', 'upload': upload.to_dict()}), 409
+            if upload.hash and compute_hash(temp_path_of(upload), 'sha256') != upload.hash.lower():
+                return jsonify({'error': 'File does not match its checksum', 'upload': upload.to_dict()}), 422
+
+            data_path = data_path_of(upload)
+            os.makedirs(os.path.dirname(data_path), exist_ok=True)
+            os.replace(temp_path_of(upload), data_path)
+            invalidate_file_tree(upload.userId)
+            upload.status = 'done'
+            upload.updatedAt = datetime.now()
+            db.session.commit()
+            return jsonify(upload.to_dict()), 200
+        except PermissionError as e:
+            return jsonify({'error': str(e)}), 403
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
+
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    # waits for a part being written, its partial file is removed after it
+    with upload_lock(upload_id):
+        try:
+            upload = Upload.query.get(upload_id)
+            if not upload:
+                return jsonify({'error': f'Upload with ID {upload_id} not found'}), 404
+            authorize_user(upload.userId)
+            if upload.status == 'uploading' and os.path.exists(temp_path_of(upload)):
+                os.unlink(temp_path_of(upload))
+            db.session.delete(upload)
+            db.session.commit()
+            return jsonify({'message': 'Upload deleted successfully'}), 200
+        except PermissionError as e:
+            return jsonify({'error': str(e)}), 403
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
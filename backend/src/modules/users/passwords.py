@@ -0,0 +1,110 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from __main__ import app
+from utils.metrics import register_stats
+
+# bcrypt releases the GIL, so the workers hash in parallel while the request threads wait
+PASSWORD_WORKERS = 4
+# requests waiting for a worker beyond this are rejected instead of piling up
+MAX_QUEUED_PASSWORD_TASKS = 32
+# seconds a rejected client is asked to wait before retrying
+RETRY_AFTER_SECONDS = 1
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix='bcrypt')
+_slots = threading.BoundedSemaphore(PASSWORD_WORKERS + MAX_QUEUED_PASSWORD_TASKS)
+_stats_lock = threading.Lock()
+_stats = {
+    'completed': 0,
+    'rejected': 0,
+    'inFlight': 0,
+    'queueWaitSeconds': 0.0,
+    'maxQueueWaitSeconds': 0.0,
+    'hashSeconds': 0.0,
+    'maxHashSeconds': 0.0,
+}
+
+
+class PasswordHasherBusy(RuntimeError):
+    """
+    Raised when the password hashing queue is full, the request can be retried after RETRY_AFTER_SECONDS.
+    """
+
+
+def hash_password(password: str) -> str:
+    """
+    Hashes a password with bcrypt on the password executor, using the configured work factor.
+
+    Raises:
+        PasswordHasherBusy: If too many password operations are already waiting
+    """
+    rounds = app.config['BCRYPT_ROUNDS']
+    return _run(lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8'))
+
+
+def check_password(password: str, hashed_password: str) -> bool:
+    """
+    Checks a password against its bcrypt hash on the password executor.
+    The work factor is the one stored in the hash.
+
+    Raises:
+        PasswordHasherBusy: If too many password operations are already waiting
+    """
+    return _run(lambda: bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8')))
+
+
+def _run(task):
+    if not _slots.acquire(blocking=False):
+        with _stats_lock:
+            _stats['rejected'] += 1
+        raise PasswordHasherBusy('Too many password operations in progress, retry shortly')
+
+    submitted_at = time.perf_counter()
+
+    def timed():
+        started_at = time.perf_counter()
+        try:
+            return task()
+        finally:
+            finished_at = time.perf_counter()
+            with _stats_lock:
+                _record('queueWaitSeconds', 'maxQueueWaitSeconds', started_at - submitted_at)
+                _record('hashSeconds', 'maxHashSeconds', finished_at - started_at)
+                _stats['completed'] += 1
+
+    with _stats_lock:
+        _stats['inFlight'] += 1
+    try:
+        return _executor.submit(timed).result()
+    finally:
+        with _stats_lock:
+            _stats['inFlight'] -= 1
+        _slots.release()
+
+
+def _record(total_key, max_key, seconds):
+    _stats[total_key] += seconds
+    _stats[max_key] = max(_stats[max_key], seconds)
+
+
+def password_stats() -> dict:
+    with _stats_lock:
+        completed = _stats['completed']
+        return {
+            'workers': PASSWORD_WORKERS,
+            'maxQueued': MAX_QUEUED_PASSWORD_TASKS,
+            'rounds': app.config['BCRYPT_ROUNDS'],
+            'completed': completed,
+            'rejected': _stats['rejected'],
+            'inFlight': _stats['inFlight'],
+            'avgQueueWaitSeconds': _stats['queueWaitSeconds'] / completed if completed else 0.0,
+            'maxQueueWaitSeconds': _stats['maxQueueWaitSeconds'],
+            'avgHashSeconds': _stats['hashSeconds'] / completed if completed else 0.0,
+            'maxHashSeconds': _stats['maxHashSeconds'],
+        }
+
+
+register_stats('passwords', password_stats)
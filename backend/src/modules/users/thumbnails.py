@@ -0,0 +1,93 @@
+import os
+import tempfile
+
+from PIL import Image, ImageOps
+
+# square bounds of the thumbnails kept for each profile picture, in pixels
+THUMBNAIL_SIZES = (48, 96, 256)
+THUMBNAIL_QUALITY = 85
+# folder of a user's profile picture, the only images thumbnails are made of
+PROFILE_PICTURE_FOLDER = 'profile_picture'
+# raised by Pillow for files that are not images it can decode
+DECODE_ERRORS = (OSError, Image.DecompressionBombError)
+
+
+def is_profile_picture_path(relative_path: str) -> bool:
+    """
+    Tells whether a normalized path relative to the upload folder is a profile picture,
+    "<user id>/profile_picture/<file>". Those live outside the user's data folder.
+    """
+    parts = relative_path.split(os.sep)
+    return len(parts) == 3 and parts[0].isdigit() and parts[1] == PROFILE_PICTURE_FOLDER
+
+
+def pick_thumbnail_size(requested: int) -> int:
+    """
+    Returns the smallest thumbnail size that covers the requested size, the largest one otherwise.
+    """
+    for size in THUMBNAIL_SIZES:
+        if size >= requested:
+            return size
+    return THUMBNAIL_SIZES[-1]
+
+
+def thumbnail_path(original_path: str, size: int) -> str:
+    """
+    Returns the path of a thumbnail, stored in a thumbnails folder next to the original.
+    Only profile pictures get thumbnails, so they never land in a user's data folder.
+    """
+    directory, filename = os.path.split(original_path)
+    return os.path.join(directory, 'thumbnails', f'{os.path.splitext(filename)[0]}_{size}.webp')
+
+
+def generate_thumbnails(original_path: str) -> list[str]:
+    """
+    Writes a thumbnail of an image for each of the THUMBNAIL_SIZES.
+
+    Args:
+        original_path (str): The path of the uploaded image
+
+    Returns:
+        list[str]: The paths of the thumbnails
+    """
+    with Image.open(original_path) as image:
+        # phone photos store their orientation in EXIF instead of rotating the pixels
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        paths = []
+        for size in THUMBNAIL_SIZES:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size), Image.Resampling.LANCZOS)
+            paths.append(_save(thumbnail, thumbnail_path(original_path, size)))
+        return paths
+
+
+def get_thumbnail(original_path: str, size: int):
+    """
+    Returns the path of a thumbnail of an image, generating the thumbnails first
+    if they are missing or older than the image. Returns None when the file is not
+    an image that can be decoded.
+    """
+    path = thumbnail_path(original_path, size)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(original_path):
+        try:
+            generate_thumbnails(original_path)
+        except DECODE_ERRORS as e:
+            print(f"cannot make thumbnails of {original_path}: {e}")
+            return None
+    return path
+
+
+def _save(image, path: str) -> str:
+    # written next to its final path and renamed, concurrent requests never serve a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.webp')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            image.save(temp_file, 'WEBP', quality=THUMBNAIL_QUALITY, method=4)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return path
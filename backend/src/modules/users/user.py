@@ -1,13 +1,28 @@
-from utils.create_directory_structure import create_directory_structure
-from flask import json, request, jsonify, send_from_directory
-import bcrypt
+from utils.create_directory_structure import create_directory_structure, remove_stale_files, resolve_upload_path
+from utils.hash import cached_file_digest
+from files.tree import get_file_tree, invalidate_file_tree
+from users.thumbnails import generate_thumbnails, get_thumbnail, is_profile_picture_path, pick_thumbnail_size
+from users.session import bearer_token, issue_token, read_token
+from users.passwords import RETRY_AFTER_SECONDS, PasswordHasherBusy, check_password, hash_password
+from utils.cache import LRUCache
+from utils.metrics import register_stats
+from flask import json, request, jsonify, send_file
 import os
 from __main__ import app, db
+from sqlalchemy import or_
 from sqlalchemy.exc import IntegrityError
 from werkzeug.utils import secure_filename
+import hashlib
 
 BASE_DIR = os.path.abspath("./")
 app.config['UPLOAD_FOLDER'] = os.path.join(BASE_DIR, 'files')
+# an uploaded picture is never rewritten under the same path, clients revalidate with ETag / Last-Modified after that
+IMAGE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+# users by id, updates invalidate their entry and the TTL bounds how stale other changes can get
+USER_CACHE_TTL_SECONDS = 300
+
+user_cache = LRUCache(max_entries=4096, ttl_seconds=USER_CACHE_TTL_SECONDS)
+register_stats('userCache', user_cache.stats)
 
 class User(db.Model):  # Make User inherit from db.Model for SQLAlchemy compatibility
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -48,7 +63,7 @@ def get_user_by_id_controller(user_id):
     Get user details by ID.
     """
     try:
-        user = User.query.get(user_id)
+        user = get_cached_user(user_id)
         if user:
             return user
         else:
@@ -56,6 +71,49 @@ def get_user_by_id_controller(user_id):
     except Exception as e:
         return None
 
+def get_cached_user(user_id):
+    """
+    Returns a user by id through the user cache, only reading the database on a miss.
+    The cached user is a copy detached from any session, it must not be modified.
+
+    Returns:
+        User: The user, None if there is no user with this id
+    """
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    user = user_cache.get(user_id)
+    if user is None:
+        row = User.query.get(user_id)
+        if not row:
+            return None
+        user = User(**{column.name: getattr(row, column.name) for column in User.__table__.columns})
+        user_cache.set(user_id, user)
+    return user
+
+def invalidate_user(user_id):
+    user_cache.pop(int(user_id), None)
+
+def authorize_user(user_id, headers=None):
+    """
+    Returns the user a request acts for. The request must carry a session token
+    (Authorization: Bearer <token>) issued to that user.
+
+    Args:
+        user_id (int): The id of the user
+        headers: The headers of the request, those of the current Flask request by default
+
+    Raises:
+        PermissionError: If the session token is missing, invalid or belongs to another user
+    """
+    token = bearer_token(headers if headers is not None else request.headers)
+    if token is None:
+        raise PermissionError('A session token is required')
+    if str(read_token(token)) != str(user_id):
+        raise PermissionError('Session token is invalid or belongs to another user')
+    return get_cached_user(user_id)
+
 @app.route('/signup', methods=['POST'])
 def create_user():
     try:
@@ -67,7 +125,7 @@ def create_user():
             print("Error")
             return jsonify({'error': 'Username, email, and password are required'}), 400
 
-        hashed_password = bcrypt.hashpw(data['password'].encode('utf-8'), bcrypt.gensalt()).decode('utf-8')        
+        hashed_password = hash_password(data['password'])
         # Create new user first to get the ID
         new_user = User(
             username=data['username'],
@@ -93,6 +151,11 @@ def create_user():
             profile_picture_path = os.path.join(str(new_user.id), 'profile_picture', filename)
             full_path = os.path.join(app.config['UPLOAD_FOLDER'], profile_picture_path)
             profile_picture.save(full_path)
+            try:
+                generate_thumbnails(full_path)
+            except Exception as e:
+                # they are generated on the first request instead
+                print(f"failed to generate the thumbnails of {full_path}: {e}")
             
             # Update the user's profile picture path in the database
             new_user.profilePicture = profile_picture_path
@@ -103,58 +166,64 @@ def create_user():
 
         return jsonify({
             'message': 'User created successfully',
-            'user': new_user.to_dict()
+            'user': new_user.to_dict(),
+            'token': issue_token(new_user.id)
         }), 201
 
+    except PasswordHasherBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(RETRY_AFTER_SECONDS)}
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
     
 @app.route('/images/<path:filename>', methods=['GET'])
 def get_image(filename):
+    """
+    Serves an uploaded image, or the thumbnail of a profile picture when a size in pixels
+    is given. The original is served when the picture cannot be decoded.
+    Responses can be cached and are revalidated with If-None-Match / If-Modified-Since.
+    """
     try:
-        # Log the requested filename for debugging
-        print(f"Requested filename: {filename}")
-        
         # The filename already contains the full path like "2/profile_picture/image.jpg"
-        # Split it to get the directory and actual filename
         file_path = os.path.normpath(filename)
         
         # Prevent directory traversal
-        if file_path.startswith('..') or file_path.startswith('/'):
+        if file_path.startswith('..') or os.path.isabs(file_path):
             return "Invalid path", 400
-            
-        # Get the full directory path
-        directory = os.path.join(app.config['UPLOAD_FOLDER'], os.path.dirname(file_path))
-        filename = os.path.basename(file_path)
-        
-        # Log the full path for debugging
-        print(f"Looking for file in: {directory}")
-        print(f"Filename: {filename}")
-        
-        # Check if file exists
-        full_path = os.path.join(directory, filename)
-        if not os.path.exists(full_path):
-            print(f"File not found at: {full_path}")
-            return f"File not found: {filename}", 404
-            
-        return send_from_directory(directory, filename)
+
+        full_path = os.path.join(app.config['UPLOAD_FOLDER'], file_path)
+        if not os.path.isfile(full_path):
+            return f"File not found: {os.path.basename(file_path)}", 404
+
+        size = request.args.get('size', type=int)
+        if size:
+            if not is_profile_picture_path(file_path):
+                return "Thumbnails are only available for profile pictures", 400
+            full_path = get_thumbnail(full_path, pick_thumbnail_size(size)) or full_path
+
+        return send_file(full_path, max_age=IMAGE_MAX_AGE_SECONDS, conditional=True, etag=True)
     except Exception as e:
-        print(f"Error serving image: {str(e)}")
         return f"Error: {str(e)}", 500
    
     
 @app.route('/login', methods=['POST'])
 def login_user():
     data = request.get_json()
-    user = User.query.filter_by(email=data.get('emailOrUsername')).first()
-    if not user or user == None:
-        user = User.query.filter_by(username=data.get('emailOrUsername')).first()
+    # one query for both, a match on the email wins over a match on the username
+    email_or_username = data.get('emailOrUsername')
+    users = User.query.filter(or_(User.email == email_or_username, User.username == email_or_username)).limit(2).all()
+    user = next((user for user in users if user.email == email_or_username), users[0] if users else None)
 
-    if user and bcrypt.checkpw(data.get('password').encode('utf-8'), user.password.encode('utf-8')):
+    try:
+        valid_password = user is not None and check_password(data.get('password'), user.password)
+    except PasswordHasherBusy as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(RETRY_AFTER_SECONDS)}
+
+    if valid_password:
         return jsonify({
             'message': 'User created successfully',
-            'user': user.to_dict()
+            'user': user.to_dict(),
+            'token': issue_token(user.id)
         }), 201
     else:
         return jsonify({'error': 'Invalid email or password'}), 401
@@ -165,7 +234,7 @@ def get_user_by_id(user_id):
     Get user details by ID.
     """
     try:
-        user = User.query.get(user_id)
+        user = get_cached_user(user_id)
         if user:
             return jsonify(user.to_dict()), 200
         else:
@@ -226,14 +295,17 @@ def update_user_by_email(email):
             user.email = data.get('email', user.email)
             print(user.email)
             if data.get('password'):
-                hashed_password = bcrypt.hashpw(data.get('password').encode('utf-8'), bcrypt.gensalt())
-                user.password = hashed_password.decode('utf-8')  # Store as a string in the database
+                user.password = hash_password(data.get('password'))
             user.school = data.get('school', user.school)
             user.major = data.get('major', user.major)
             db.session.commit()
+            invalidate_user(user.id)
             return jsonify({'message': 'User updated successfully', 'user': user.to_dict()}), 200
         else:
             return jsonify({'error': f'User with email {email} not found'}), 404
+    except PasswordHasherBusy as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 503, {'Retry-After': str(RETRY_AFTER_SECONDS)}
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
@@ -242,56 +314,99 @@ def update_user_by_email(email):
 def get_user_files(user_id):
     """
     Returns the folder containing files for the given user ID in a recursive structure.
+    Answers If-None-Match with a 304 when the tree did not change.
     """
     try:
         # Check if the user exists (assume User is a valid model with query)
-        user = User.query.get(user_id)
+        user = authorize_user(user_id)
         if not user:
             return jsonify({'error': f'User with ID {user_id} not found'}), 404
 
-        # Define the folder path
-        folder_path = f"files/{user_id}/data"
-        
-        # Check if the directory exists
-        if not os.path.exists(folder_path):
+        # Served from the cache, a client holding the current version gets a 304
+        directory_structure, etag = get_file_tree(user_id)
+        if directory_structure is None:
             return jsonify({'error': f'No folder found for user with ID {user_id}'}), 404
+        if etag in request.if_none_match:
+            response = app.response_class(status=304)
+        else:
+            response = jsonify(directory_structure)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
 
-        # Recursive function to build the directory structure
-        def build_directory_structure(path):
-            if os.path.basename(path)[0] == '.':
-                return None
-            structure = {
-                "name": os.path.basename(path),
-                "files": [{"name": f} for f in os.listdir(path) if (os.path.isfile(os.path.join(path, f)) and f[0] != '.')],
-                "subdirectories": []
-            }
-            for subdir in os.listdir(path):
-                full_subdir_path = os.path.join(path, subdir)
-                if os.path.isdir(full_subdir_path):
-                    structure["subdirectories"].append(build_directory_structure(full_subdir_path))
-            return structure
-
-        # Build the directory structure starting from the root folder
-        directory_structure = build_directory_structure(folder_path)
-
-        return jsonify(directory_structure), 200
-
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
     except Exception as e:
         return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
 
 @app.route('/users/<user_id>/uploadFiles', methods=['POST'])
 def upload_files(user_id):
     try:
-        user = User.query.get(user_id)
+        user = authorize_user(user_id)
         if not user:
-            return jsonify({'error': f'User not found'}), 404
+            return jsonify({'error': 'User not found'}), 404
         
         # directory_metadata = request.form.get('directoryMetadata')
         files = request.files.getlist('files')
         base_path = os.path.normpath(os.path.join('./files', str(user_id), 'data'))
-        
-        create_directory_structure(base_path, files)
+        # after a manifest only the missing files are sent, the others must be kept
+        partial = request.form.get('partial') == 'true'
+
+        changes = create_directory_structure(base_path, files, remove_stale=not partial)
+        invalidate_file_tree(user_id)
 
-        return jsonify({"message": "Files uploaded successfully"}), 200
+        return jsonify({"message": "Files uploaded successfully", **changes}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
     except Exception as e:
-        return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
+
+@app.route('/users/<user_id>/uploadFiles/manifest', methods=['POST'])
+def upload_manifest(user_id):
+    """
+    Compares the manifest of the client's folder with the user's data folder.
+
+    The body lists every file of the folder as {"path", "hash", "size"}, hashed with
+    "algorithm" (sha256 by default). Files on the server that are not in the manifest
+    are removed, and the paths the server is missing or holds different bytes for are
+    returned. The client then uploads only those through uploadFiles with partial=true.
+    """
+    try:
+        user = authorize_user(user_id)
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+
+        data = request.get_json(silent=True) or {}
+        algorithm = data.get('algorithm', 'sha256')
+        if algorithm not in hashlib.algorithms_guaranteed:
+            return jsonify({'error': f'Unsupported hash algorithm: {algorithm}'}), 400
+        base_path = os.path.normpath(os.path.join('./files', str(user_id), 'data'))
+        os.makedirs(base_path, exist_ok=True)
+
+        entries = {}
+        for entry in data.get('files', []):
+            entries[resolve_upload_path(base_path, entry['path'])] = entry
+
+        removed = remove_stale_files(base_path, set(entries))
+        if removed:
+            invalidate_file_tree(user_id)
+
+        missing = []
+        for file_path, entry in entries.items():
+            # a different size settles it without reading the file
+            if (
+                not os.path.isfile(file_path)
+                or ('size' in entry and os.path.getsize(file_path) != entry['size'])
+                or cached_file_digest(file_path, algorithm) != entry['hash'].lower()
+            ):
+                missing.append(entry['path'])
+
+        return jsonify({'missing': missing, 'removed': removed}), 200
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({'error': 'Invalid manifest', 'details': str(e)}), 400
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except Exception as e:
+        return jsonify({'error': 'An error occurred', 'details': str(e)}), 500
@@ -1,23 +1,115 @@
+import filecmp
 import os
 import shutil
+import tempfile
 
-def create_directory_structure(base_path, files):
-    """ Recursively create directories based on metadata. """
-    # Clear the directory if it already exists
-    # if os.path.exists(base_path):
-    #     shutil.rmtree(base_path)
-    
-    # Create the base directory
-    # os.makedirs(base_path, exist_ok=True)
-
-    clear_directory(base_path)
-    # Create all files
-    for file in files:
-        file_path = os.path.join(base_path, file.filename)
-        directory_path = os.path.dirname(file_path)
-        if not os.path.exists(directory_path):
-            os.makedirs(directory_path)
-        file.save(os.path.join(file_path))
+# folder next to a user's data folder where uploads are written before being moved in,
+# on the same filesystem so the move is a rename, and never seen by the data walkers
+STAGING_FOLDER = '.uploads'
+
+def staging_path_of(base_path):
+    """
+    Returns the staging folder of a data folder, its sibling STAGING_FOLDER.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(base_path)), STAGING_FOLDER)
+
+def create_directory_structure(base_path, files, remove_stale=True):
+    """
+    Writes the uploaded files under base_path, keeping the rest of the tree in place.
+
+    A file whose contents did not change is left untouched so that its fingerprint
+    stays the same and it is not hashed or ingested again. Each file is written to a
+    temporary file in the staging folder first and moved into place, so readers
+    never see a partial file.
+
+    Args:
+        base_path (str): The data folder of the user
+        files (list[FileStorage]): The uploaded files, named by their path relative to base_path
+        remove_stale (bool): Remove the files of the tree that were not uploaded
+
+    Returns:
+        dict: The paths written and the paths removed, relative to base_path
+
+    Raises:
+        ValueError: If the path of an uploaded file points outside base_path
+    """
+    os.makedirs(base_path, exist_ok=True)
+    targets = [(file, resolve_upload_path(base_path, file.filename)) for file in files]
+    staging_path = staging_path_of(base_path)
+
+    written = []
+    for file, file_path in targets:
+        if write_file(file, file_path, staging_path):
+            written.append(os.path.relpath(file_path, base_path))
+
+    removed = []
+    if remove_stale:
+        removed = remove_stale_files(base_path, {file_path for _, file_path in targets})
+    return {'written': written, 'removed': removed}
+
+def resolve_upload_path(base_path, relative_path):
+    """
+    Returns the absolute path of an uploaded file inside base_path.
+
+    Raises:
+        ValueError: If the path is empty, absolute or escapes base_path
+    """
+    normalized = os.path.normpath(relative_path or '')
+    if normalized in ('', '.') or os.path.isabs(normalized) or normalized.split(os.sep)[0] == '..':
+        raise ValueError(f"Invalid file path: {relative_path}")
+    return os.path.join(os.path.abspath(base_path), normalized)
+
+def write_file(file, file_path, staging_path):
+    """
+    Saves an uploaded file through a temporary file in staging_path and replaces
+    file_path with it, unless file_path already holds the same bytes.
+
+    Args:
+        file (FileStorage): The uploaded file
+        file_path (str): The path to write
+        staging_path (str): Folder for the temporary file, on the same filesystem as file_path
+
+    Returns:
+        bool: True if file_path was written
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    os.makedirs(staging_path, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=staging_path, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            shutil.copyfileobj(file.stream, temp_file)
+        if os.path.isfile(file_path) and filecmp.cmp(temp_path, file_path, shallow=False):
+            os.unlink(temp_path)
+            return False
+        os.replace(temp_path, file_path)
+        return True
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+def remove_stale_files(base_path, keep):
+    """
+    Removes the files under base_path that are not in keep, one by one, and the folders left empty.
+
+    Args:
+        base_path (str): The data folder of the user
+        keep (set[str]): The absolute paths of the files to keep
+
+    Returns:
+        list[str]: The removed paths, relative to base_path
+    """
+    base_path = os.path.abspath(base_path)
+    removed = []
+    for root, dirs, files in os.walk(base_path, topdown=False):
+        for file in files:
+            file_path = os.path.join(root, file)
+            if file_path not in keep:
+                os.unlink(file_path)
+                removed.append(os.path.relpath(file_path, base_path))
+        if root != base_path and not os.listdir(root):
+            os.rmdir(root)
+    return removed
 
 def clear_directory(directory_path: str):
     """
@@ -30,4 +122,4 @@ def clear_directory(directory_path: str):
         if os.path.isfile(item_path) or os.path.islink(item_path):  # Check if it's a file or symlink
             os.unlink(item_path)  # Remove the file or symlink
         elif os.path.isdir(item_path):  # Check if it's a directory
-            shutil.rmtree(item_path)  # Recursively delete the directory
\ No newline at end of file
+            shutil.rmtree(item_path)  # Recursively delete the directory
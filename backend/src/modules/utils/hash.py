@@ -1,4 +1,9 @@
 import hashlib
+import mmap
+import os
+
+from utils.cache import LRUCache
+from utils.metrics import register_stats
 
 # Compute file hash
 # def compute_hash(file_path):
@@ -6,29 +11,86 @@ import hashlib
 
 
 
+# new files are hashed with BLAKE2b, hashes of other algorithms are stored as '<algorithm>:<digest>'
+DEFAULT_ALGORITHM = 'blake2b'
+# rows hashed before the algorithm was recorded hold a bare sha256 digest
+LEGACY_ALGORITHM = 'sha256'
+READ_SIZE = 1024 * 1024
+
+# digests of files on disk keyed by path, algorithm and fingerprint, a rewritten file gets a new key
+_digest_cache = LRUCache(max_entries=20000)
+register_stats('fileDigests', _digest_cache.stats)
+
+
 def compute_hash(file_path, algorithm='sha256'):
     """
     Hashes the contents of a file using the specified algorithm.
+    The file is memory mapped so that it is hashed in a single call without copies.
 
     Args:
         file_path (str): The path to the file to hash.
-        algorithm (str): The hashing algorithm to use (e.g., 'md5', 'sha1', 'sha256').
+        algorithm (str): The hashing algorithm to use (e.g., 'md5', 'sha1', 'sha256', 'blake2b').
 
     Returns:
         str: The hexadecimal digest of the file's hash.
     """
     try:
         # Create a hash object based on the algorithm
-        hash_func = hashlib.new(algorithm)
+        if algorithm == 'blake2b':
+            hash_func = hashlib.blake2b(digest_size=32)
+        else:
+            hash_func = hashlib.new(algorithm)
         
-        # Open the file in binary mode and read in chunks
+        # Open the file in binary mode and map it, falling back to large reads
         with open(file_path, 'rb') as f:
-            while chunk := f.read(8192):  # Read in 8KB chunks
-                hash_func.update(chunk)
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    hash_func.update(mapped)
+            except (ValueError, OSError):    # empty files and files that cannot be mapped
+                while chunk := f.read(READ_SIZE):
+                    hash_func.update(chunk)
         
         # Return the hexadecimal digest of the hash
         return hash_func.hexdigest()
     except FileNotFoundError:
         return f"Error: File not found - {file_path}"
     except ValueError:
-        return f"Error: Invalid hashing algorithm - {algorithm}"
\ No newline at end of file
+        return f"Error: Invalid hashing algorithm - {algorithm}"
+
+
+def hash_algorithm_of(stored_hash):
+    """
+    Returns the algorithm a stored file hash was computed with.
+    """
+    if stored_hash and ':' in stored_hash:
+        return stored_hash.split(':', 1)[0]
+    return LEGACY_ALGORITHM
+
+
+def compute_file_hash(file_path, algorithm=DEFAULT_ALGORITHM):
+    """
+    Hashes a file and tags the digest with its algorithm, legacy sha256 digests stay bare.
+    """
+    digest = compute_hash(file_path, algorithm)
+    return digest if algorithm == LEGACY_ALGORITHM else f"{algorithm}:{digest}"
+
+
+def file_fingerprint(file_path):
+    """
+    Returns the (size, mtime_ns, inode) of a file, which change whenever its contents are rewritten.
+    """
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def cached_file_digest(file_path, algorithm=LEGACY_ALGORITHM):
+    """
+    Returns the hexadecimal digest of a file, only hashing it again when its
+    (size, mtime_ns, inode) changed since it was last hashed.
+    """
+    key = (file_path, algorithm, file_fingerprint(file_path))
+    digest = _digest_cache.get(key)
+    if digest is None:
+        digest = compute_hash(file_path, algorithm)
+        _digest_cache.set(key, digest)
+    return digest
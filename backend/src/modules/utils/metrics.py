@@ -0,0 +1,28 @@
+import threading
+
+_lock = threading.Lock()
+_stats_sources = {}
+
+
+def register_stats(name, stats_function):
+    """
+    Registers a callable that reports the stats of a long-lived component.
+
+    Args:
+        name (str): The key under which the stats are reported
+        stats_function (callable): A function returning a JSON serializable dict
+    """
+    with _lock:
+        _stats_sources[name] = stats_function
+
+
+def collect_stats():
+    """
+    Collects the stats of every registered component.
+
+    Returns:
+        dict: The stats of each component keyed by its registered name
+    """
+    with _lock:
+        sources = dict(_stats_sources)
+    return {name: stats_function() for name, stats_function in sources.items()}
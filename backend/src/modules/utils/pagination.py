@@ -0,0 +1,42 @@
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def parse_page_args(args, default_limit: int = DEFAULT_PAGE_SIZE, max_limit: int = MAX_PAGE_SIZE):
+    """
+    Reads the keyset pagination arguments of a request.
+
+    Args:
+        args: The query arguments of the request
+        default_limit (int): The page size used when no limit is given
+        max_limit (int): The largest page size allowed
+
+    Returns:
+        tuple[int, int]: The page size and the id to start before (None for the first page)
+
+    Raises:
+        ValueError: If limit or before is not a positive integer
+    """
+    limit = args.get('limit', default_limit, type=int)
+    before = args.get('before', None, type=int)
+    if limit is None or limit < 1:
+        raise ValueError('limit must be a positive integer')
+    if 'before' in args and (before is None or before < 1):
+        raise ValueError('before must be a positive integer')
+    return min(limit, max_limit), before
+
+
+def keyset_page(query, id_column, limit: int, before: int = None):
+    """
+    Returns a page of a query ordered by descending id, starting before the given id.
+
+    Returns:
+        tuple[list, int]: The rows, newest first, and the cursor of the next page (None on the last page)
+    """
+    if before is not None:
+        query = query.filter(id_column < before)
+    rows = query.order_by(id_column.desc()).limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
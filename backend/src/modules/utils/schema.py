@@ -0,0 +1,27 @@
+from sqlalchemy import inspect, text
+
+
+def upgrade_schema(db):
+    """
+    Adds the columns and indexes declared on the models that are missing from existing
+    tables. db.create_all only creates missing tables, so columns and indexes added to
+    a model later would otherwise never reach an existing database. New columns must
+    be nullable or have a default.
+
+    Args:
+        db (SQLAlchemy): The database of the app, called inside an app context
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
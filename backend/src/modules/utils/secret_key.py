@@ -0,0 +1,40 @@
+import os
+import secrets
+import sys
+
+SECRET_KEY_PATH = "./db/secret_key"
+
+
+def load_secret_key(path: str = SECRET_KEY_PATH) -> str:
+    """
+    Returns the key signing the session tokens, from LESSNOTES_SECRET_KEY.
+
+    Without it the key is read from a file next to the database, created on first
+    start, so that every worker process and restart of the server shares the same key.
+    A loud warning is printed since that key is only as safe as the file.
+    """
+    key = os.environ.get('LESSNOTES_SECRET_KEY')
+    if key:
+        return key
+
+    print(
+        f"WARNING: LESSNOTES_SECRET_KEY is not set, session tokens are signed with the key in {path}. "
+        "Set LESSNOTES_SECRET_KEY in production.",
+        file=sys.stderr,
+    )
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if not os.path.exists(path):
+        # written aside and linked into place, so that a process starting at the same
+        # time either sees the whole key or creates its own and loses the race
+        temp_path = f"{path}.{os.getpid()}"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as key_file:
+            key_file.write(secrets.token_hex(32))
+        try:
+            os.link(temp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(temp_path)
+    with open(path) as key_file:
+        return key_file.read().strip()
@@ -0,0 +1,65 @@
+from sqlalchemy import event
+
+# 'default' keeps the settings of SQLite and the sqlite3 module (rollback journal),
+# 'concurrent' lets readers run alongside a writer and makes writers wait instead of failing
+STORAGE_PROFILES = {
+    'default': {
+        'pragmas': {},
+        'busy_timeout_seconds': 5,          # the sqlite3 module default
+        'pool_size': 5,
+        'max_overflow': 10,
+    },
+    'concurrent': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'cache_size': -64000,           # in KiB when negative, about 64 MB
+            'mmap_size': 256 * 1024 * 1024,
+            'temp_store': 'MEMORY',
+        },
+        'busy_timeout_seconds': 15,
+        'pool_size': 10,
+        'max_overflow': 20,
+    },
+}
+DEFAULT_PROFILE = 'concurrent'
+
+
+def get_profile(name: str) -> dict:
+    if name not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile '{name}', expected one of {', '.join(STORAGE_PROFILES)}")
+    return STORAGE_PROFILES[name]
+
+
+def engine_options(name: str = DEFAULT_PROFILE) -> dict:
+    """
+    Returns the SQLAlchemy engine options of a storage profile.
+    The busy timeout is passed to sqlite3 so that it applies to every pooled connection.
+    """
+    profile = get_profile(name)
+    return {
+        'pool_size': profile['pool_size'],
+        'max_overflow': profile['max_overflow'],
+        'pool_pre_ping': False,
+        'connect_args': {
+            'timeout': profile['busy_timeout_seconds'],
+            'check_same_thread': False,
+        },
+    }
+
+
+def apply_pragmas(engine, name: str = DEFAULT_PROFILE) -> None:
+    """
+    Runs the pragmas of a storage profile on every new connection of the engine.
+    Must be called before the engine opens its first connection.
+    """
+    pragmas = get_profile(name)['pragmas']
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas.items():
+            cursor.execute(f'PRAGMA {pragma}={value}')
+        cursor.close()
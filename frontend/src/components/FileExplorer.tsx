@@ -3,7 +3,7 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle } from "@/components/u
 import { ScrollArea } from "@/components/ui/scroll-area";
 import { FolderOpen, File, ChevronRight, ChevronDown, Folder, Minus } from "lucide-react";
 import { Button } from "./ui/button";
-import Axios from "axios";
+import Axios, { AxiosInstance } from "axios";
 import AlertComponent from "./AlertComponent";
 
 interface Directory {
@@ -290,6 +290,46 @@ const deleteFolder = (folderId: string) => {
   setRootDirectory(removeFolder(rootDirectory));
 };
 
+// Files larger than this are uploaded in parts through the resumable upload endpoint
+const RESUMABLE_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const UPLOAD_PART_SIZE = 8 * 1024 * 1024;
+const UPLOAD_PART_RETRIES = 5;
+
+const toHex = (buffer: ArrayBuffer) =>
+  Array.from(new Uint8Array(buffer)).map(b => b.toString(16).padStart(2, '0')).join('');
+
+// Uploads a file part by part, resuming from the offset acknowledged by the server after a failure
+const uploadResumable = async (axiosClient: AxiosInstance, userId: number, file: File, path: string, hash?: string) => {
+  const created = await axiosClient.post(`/users/${userId}/uploads`, {
+    path,
+    size: file.size,
+    partSize: UPLOAD_PART_SIZE,
+    hash,
+  });
+  const uploadId = created.data.id;
+  let offset = 0;
+  let failures = 0;
+  while (offset < file.size) {
+    const part = await file.slice(offset, offset + UPLOAD_PART_SIZE).arrayBuffer();
+    try {
+      const response = await axiosClient.put(`/uploads/${uploadId}/parts?offset=${offset}`, part, {
+        headers: {
+          'Content-Type': 'application/octet-stream',
+          'X-Checksum-Sha256': toHex(await crypto.subtle.digest('SHA-256', part)),
+        },
+      });
+      offset = response.data.offset;
+      failures = 0;
+    } catch (error) {
+      if (++failures > UPLOAD_PART_RETRIES) throw error;
+      // ask the server where to resume from
+      const status = await axiosClient.get(`/uploads/${uploadId}`);
+      offset = status.data.offset;
+    }
+  }
+  await axiosClient.post(`/uploads/${uploadId}/complete`);
+};
+
 const sendData = async () => {
   if (!rootDirectory) {
     console.error("No directory data to send.");
@@ -305,34 +345,56 @@ const sendData = async () => {
   }, 500); 
 
   try {
-    // Create a FormData object
-    const formData = new FormData();
-
-    // Serialize directory metadata (including file names, sizes, and paths)
-
-    // Append the files to the FormData object
+    // Collect every file of the folder with its path relative to the data folder
+    const entries: { file: File; path: string }[] = [];
     rootDirectory.files.forEach(file => {
-      const filePath = `${file.name}`
-      formData.append('files', file, filePath);
+      entries.push({ file, path: `${file.name}` });
     });
 
-    // Iterate over subdirectories and append their files as well
+    // Iterate over subdirectories and collect their files as well
     const appendSubdirectoryFiles = (directory: Directory) => {
       directory.subdirectories.forEach(subdir => {
         subdir.files.forEach(file => {
-          const filePath = `${subdir.id}/${file.name}`.replace(/^data\//, '');
-          formData.append('files', file, filePath); // Append file with full path
+          entries.push({ file, path: `${subdir.id}/${file.name}`.replace(/^data\//, '') });
         });
         appendSubdirectoryFiles(subdir); // Recursively process subdirectories
       });
     };
     appendSubdirectoryFiles(rootDirectory);
-    
+
     // Create axios instance
     const axiosClient = Axios.create({
       baseURL: "http://127.0.0.1:8000",  
     });
 
+    // Send the manifest, the server removes stale files and answers with the ones it is missing
+    const sha256 = async (file: File) => toHex(await crypto.subtle.digest('SHA-256', await file.arrayBuffer()));
+    // one file at a time, so only one file is held in memory
+    const manifest: { path: string; size: number; hash: string }[] = [];
+    for (const { file, path } of entries) {
+      manifest.push({ path, size: file.size, hash: await sha256(file) });
+    }
+    const manifestResponse = await axiosClient.post(`/users/${userId}/uploadFiles/manifest`, {
+      algorithm: 'sha256',
+      files: manifest,
+    });
+    const missing = new Set<string>(manifestResponse.data.missing);
+
+    // Large files are sent in parts that can be resumed, the others in one request
+    for (const { file, path } of entries) {
+      if (missing.has(path) && file.size > RESUMABLE_UPLOAD_THRESHOLD) {
+        const hash = manifest.find(entry => entry.path === path)?.hash;
+        await uploadResumable(axiosClient, userId, file, path, hash);
+      }
+    }
+
+    // Create a FormData object with only the missing files
+    const formData = new FormData();
+    formData.append('partial', 'true');
+    entries
+      .filter(({ file, path }) => missing.has(path) && file.size <= RESUMABLE_UPLOAD_THRESHOLD)
+      .forEach(({ file, path }) => formData.append('files', file, path));
+
     // Send the FormData to the backend
     const response = await axiosClient.post(`/users/${userId}/uploadFiles`, formData, {
       headers: {
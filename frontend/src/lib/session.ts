@@ -0,0 +1,26 @@
+import Axios from "axios";
+
+const SESSION_TOKEN_KEY = "sessionToken";
+
+// Axios.create copies the defaults, so every client created afterwards sends the token
+const applySessionToken = (token: string | null) => {
+  if (token) {
+    Axios.defaults.headers.common["Authorization"] = `Bearer ${token}`;
+  } else {
+    delete Axios.defaults.headers.common["Authorization"];
+  }
+};
+
+export function loadSessionToken() {
+  applySessionToken(localStorage.getItem(SESSION_TOKEN_KEY));
+}
+
+export function setSessionToken(token: string) {
+  localStorage.setItem(SESSION_TOKEN_KEY, token);
+  applySessionToken(token);
+}
+
+export function clearSessionToken() {
+  localStorage.removeItem(SESSION_TOKEN_KEY);
+  applySessionToken(null);
+}
@@ -1,5 +1,8 @@
 import { createRoot } from 'react-dom/client'
 import App from './App.tsx'
 import './index.css'
+import { loadSessionToken } from './lib/session'
+
+loadSessionToken();
 
 createRoot(document.getElementById("root")!).render(<App />);
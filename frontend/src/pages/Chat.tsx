@@ -7,6 +7,7 @@ import FileExplorer from "@/components/FileExplorer";
 import Profile from "@/components/Profile";
 import { Avatar, AvatarFallback, AvatarImage } from "@/components/ui/avatar";
 import Axios from "axios";
+import { clearSessionToken } from "@/lib/session";
 import { set } from "date-fns";
 import { useNavigate } from "react-router-dom";
 import {
@@ -30,6 +31,9 @@ interface ChatHistory {
 const Chat = () => {
   const [messages, setMessages] = useState<Message[]>([]);
   const [chatHistory, setChatHistory] = useState<ChatHistory[]>([]);
+  // cursors of the next (older) page, null once everything is loaded
+  const [messagesCursor, setMessagesCursor] = useState<number | null>(null);
+  const [chatHistoryCursor, setChatHistoryCursor] = useState<number | null>(null);
   const [input, setInput] = useState("");
   const [showFileExplorer, setShowFileExplorer] = useState(false);
   const [showProfile, setShowProfile] = useState(false);
@@ -40,6 +44,7 @@ const Chat = () => {
 
   const handleLogout = () => {
     localStorage.removeItem('currentUser');
+    clearSessionToken();
     navigate('/auth/login');
   };
 
@@ -71,7 +76,10 @@ const Chat = () => {
           //   responseType: 'blob', // Ensure we get the image as a blob
           // });
 
-          const response = await axiosClient.get("/images/" + profilePicture);
+          // the avatar is shown at 40px, a 96px thumbnail keeps it sharp on high density screens
+          const response = await axiosClient.get("/images/" + profilePicture, {
+            params: { size: 96 },
+          });
           console.log("Response:", response);
 
           // Ensure the response is successful
@@ -80,7 +88,7 @@ const Chat = () => {
           }
 
           // Create blob from array buffer
-          const blob = new Blob([response.data], { type: 'image/jpeg' });
+          const blob = new Blob([response.data], { type: response.headers['content-type'] || 'image/webp' });
 
           // Create object URL from blob
           const imageUrl = URL.createObjectURL(blob);
@@ -109,35 +117,37 @@ const Chat = () => {
       localStorage.setItem("currentConversation", currentConversation || "");
     };
 
-    const fetchChatHistory = async () => {
-      try {
-        const axiosClient = Axios.create({
-          baseURL: "http://127.0.0.1:8000",
-        });
-        const response = await axiosClient.get(`/users/${userId}/conversations`);
-        if (response.status === 200) {
-          const data = response.data;
-          const formattedChatHistory = data.conversations.map((conversation: any) => ({
-            id: conversation.id.toString(),
-            title: new Date(conversation.time).toLocaleString(), // Convert time to readable string
-          }));
-
-          formattedChatHistory.sort((a, b) => b.id.localeCompare(a.id));
-          
-          setChatHistory(formattedChatHistory);
-        } else if (response.status === 404) {
-          console.log("No chat history found.");
-        } else {
-          console.error("Failed to fetch chat history:", response.data);
-        }
-      } catch (error) {
-        console.error("Error fetching chat history:", error);
-      }
-    };
-
     fetchChatHistory();
   }, [userId]);
 
+  // conversations come newest first, a page at a time
+  const fetchChatHistory = async (before?: number) => {
+    try {
+      const axiosClient = Axios.create({
+        baseURL: "http://127.0.0.1:8000",
+      });
+      const response = await axiosClient.get(`/users/${userId}/conversations`, {
+        params: before ? { before } : {},
+      });
+      if (response.status === 200) {
+        const data = response.data;
+        const formattedChatHistory = data.conversations.map((conversation: any) => ({
+          id: conversation.id.toString(),
+          title: new Date(conversation.time).toLocaleString(), // Convert time to readable string
+        }));
+
+        setChatHistory((previous) => (before ? [...previous, ...formattedChatHistory] : formattedChatHistory));
+        setChatHistoryCursor(data.nextCursor ?? null);
+      } else if (response.status === 404) {
+        console.log("No chat history found.");
+      } else {
+        console.error("Failed to fetch chat history:", response.data);
+      }
+    } catch (error) {
+      console.error("Error fetching chat history:", error);
+    }
+  };
+
   const handleSend = async (e: React.FormEvent) => {
     e.preventDefault();
     if (!input.trim()) return;
@@ -249,14 +259,16 @@ const Chat = () => {
   };
   
 
-  const handleConversationClick = async (conversationId: string) => {
+  // messages come oldest first, each page is older than the previous one
+  const fetchMessages = async (conversationId: string, before?: number) => {
     try {
-      localStorage.setItem("currentConversation", conversationId);
       const axiosClient = Axios.create({
         baseURL: "http://127.0.0.1:8000",
       });
 
-      const response = await axiosClient.get(`/conversation/${conversationId}/messages`);
+      const response = await axiosClient.get(`/conversation/${conversationId}/messages`, {
+        params: before ? { before } : {},
+      });
       if (response.status === 200) {
         const fetchedMessages = response.data.messages.map((msg: any) => ({
           id: msg.id.toString(),
@@ -264,7 +276,8 @@ const Chat = () => {
           isUser: msg.isHuman,
         }));
 
-        setMessages(fetchedMessages);
+        setMessages((previous) => (before ? [...fetchedMessages, ...previous] : fetchedMessages));
+        setMessagesCursor(response.data.nextCursor ?? null);
       } else {
         console.error("Failed to fetch messages:", response.data);
       }
@@ -273,6 +286,18 @@ const Chat = () => {
     }
   };
 
+  const handleConversationClick = async (conversationId: string) => {
+    localStorage.setItem("currentConversation", conversationId);
+    await fetchMessages(conversationId);
+  };
+
+  const handleLoadOlderMessages = async () => {
+    const conversationId = localStorage.getItem("currentConversation");
+    if (conversationId && messagesCursor) {
+      await fetchMessages(conversationId, messagesCursor);
+    }
+  };
+
   return (
     <div className="flex h-screen bg-background">
       {/* Left Sidebar */}
@@ -309,6 +334,15 @@ const Chat = () => {
                 {chat.title}
               </Button>
             ))}
+            {chatHistoryCursor && (
+              <Button
+                variant="outline"
+                className="w-full text-sm"
+                onClick={() => fetchChatHistory(chatHistoryCursor)}
+              >
+                Load more
+              </Button>
+            )}
           </div>
         </ScrollArea>
       </div>
@@ -353,6 +387,13 @@ const Chat = () => {
             <div className="flex-grow overflow-auto p-4">
               <ScrollArea className="h-full">
                 <div className="space-y-4 max-w-3xl mx-auto">
+                  {messagesCursor && (
+                    <div className="flex justify-center">
+                      <Button variant="outline" size="sm" onClick={handleLoadOlderMessages}>
+                        Load older messages
+                      </Button>
+                    </div>
+                  )}
                   {messages.map((message) => (
                     <div
                       key={message.id}
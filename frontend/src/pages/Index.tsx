@@ -15,7 +15,8 @@ const Index = () => {
       if (currentUser) {
           try {
               const user = JSON.parse(currentUser);
-              if (user && user.id && user.email) {
+              // logins from before session tokens have to log in again
+              if (user && user.id && user.email && localStorage.getItem("sessionToken")) {
                   setIsLoggedIn(true); // User is logged in
               } else {
                   setIsLoggedIn(false); // Invalid user data
@@ -15,6 +15,7 @@ import * as z from "zod";
 import { useNavigate } from "react-router-dom";
 import { useToast } from "@/components/ui/use-toast";
 import Axios from "axios";
+import { setSessionToken } from "@/lib/session";
 
 const loginSchema = z.object({
   emailOrUsername: z.string().min(1, "Please enter your email address or username"),
@@ -53,6 +54,8 @@ const Login = () => {
 
       // Store current user in localStorage
       localStorage.setItem("currentUser", JSON.stringify(currentUser));
+      // Sent as "Authorization: Bearer <token>" to act for the user
+      setSessionToken(response.data.token);
 
       navigate("/");
     } catch (error) {